@@ -0,0 +1,641 @@
+import concurrent.futures
+import contextlib
+import io
+import math
+import os
+import random
+import struct
+import subprocess
+import tempfile
+import sys
+import time
+import tracemalloc
+import zlib
+
+import imageIO.png
+import CS373LicensePlateDetection
+
+
+# the bundled images every benchmark is run on
+BENCHMARK_IMAGES = ["numberplate{}.png".format(i) for i in range(1, 7)]
+
+
+# runs function(*args) repeats times and returns the best wall clock time in seconds
+# anything the function prints is swallowed so it doesn't disturb the benchmark output
+def timeBest(function, args, repeats=3):
+
+    best = None
+    for i in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function(*args)
+            elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def printComparison(image_name, baseline_seconds, new_seconds):
+
+    print("{:20s} before {:8.3f}s  after {:8.3f}s  speedup {:6.1f}x".format(
+        image_name, baseline_seconds, new_seconds, baseline_seconds / new_seconds))
+
+
+# the planes of each png colour type, and the bit depths it allows
+PNG_COLOUR_TYPES = {0: (1, (1, 2, 4, 8, 16)), 2: (3, (8, 16)), 3: (1, (1, 2, 4, 8)), 4: (2, (8, 16)), 6: (4, (8, 16))}
+
+
+# a png of random bytes where every scanline gets a random filter type, so that all five filters are undone
+# next to each other, straight after one another and on the first line of each interlace pass
+def randomlyFilteredPNG(image_width, image_height, bitdepth, colour_type, interlace, generator):
+
+    bits_per_pixel = bitdepth * PNG_COLOUR_TYPES[colour_type][0]
+    filter_unit = max(1, bits_per_pixel // 8)
+    passes = imageIO.png.adam7 if interlace else ((0, 0, 1, 1),)
+    raw = bytearray()
+    for (xstart, ystart, xstep, ystep) in passes:
+        if xstart >= image_width:
+            continue
+        row_bytes = math.ceil(math.ceil((image_width - xstart) / xstep) * bits_per_pixel / 8)
+        previous = None
+        for y in range(ystart, image_height, ystep):
+            line = bytes(generator.getrandbits(8) for i in range(row_bytes))
+            filter_type = generator.randrange(5)
+            raw.append(filter_type)
+            raw.extend(imageIO.png.filter_scanline(filter_type, filter_unit, line, previous))
+            previous = line
+
+    chunks = [(b"IHDR", struct.pack("!2I5B", image_width, image_height, bitdepth, colour_type, 0, 0, interlace))]
+    if colour_type == 3:
+        chunks.append((b"PLTE", bytes(3 * 2**bitdepth)))
+    chunks += [(b"IDAT", zlib.compress(bytes(raw))), (b"IEND", b"")]
+    output = io.BytesIO()
+    imageIO.png.write_chunks(output, chunks)
+    return output.getvalue()
+
+
+# decodes a png with Reader.read and, when numpy is available, with Reader.read_ndarray, returning the rows as lists
+# of values from each; unfilter_batch_bytes is the most bytes of scanlines the numpy path unfilters at once
+def decodePNGRows(data, unfilter_batch_bytes=2**20):
+
+    image_reader = imageIO.png.Reader(bytes=data)
+    image_reader.unfilter_batch_bytes = unfilter_batch_bytes
+    decodings = [[list(row) for row in image_reader.read()[2]]]
+    if imageIO.png.import_numpy() is not None:
+        image_reader = imageIO.png.Reader(bytes=data)
+        image_reader.unfilter_batch_bytes = unfilter_batch_bytes
+        pixels = image_reader.read_ndarray()[2]
+        decodings.append(pixels.reshape(pixels.shape[0], -1).tolist())
+    return decodings
+
+
+# unfiltering with numpy against the pure python undo_filter_* loops, byte for byte, on randomly filtered pngs of
+# every colour type, bit depth and interlacing, in shapes that take each of the numpy code paths: wide scanlines,
+# blocks taller than they are wide and narrow scanlines, with small unfilter batches so blocks start mid-image
+def benchmarkUnfilterParity():
+
+    generator = random.Random(373)
+    images = []
+    for (colour_type, (planes, bitdepths)) in PNG_COLOUR_TYPES.items():
+        for bitdepth in bitdepths:
+            for interlace in (0, 1):
+                for (image_width, image_height) in ((1, 1), (13, 9), (300, 40), (70, 300), (5, 400)):
+                    images.append(((colour_type, bitdepth, interlace, image_width, image_height),
+                                   randomlyFilteredPNG(image_width, image_height, bitdepth, colour_type, interlace,
+                                                       generator)))
+
+    numpy_module = imageIO.png.import_numpy()
+    imageIO.png.numpy = None
+    try:
+        expected = [decodePNGRows(data)[0] for (key, data) in images]
+    finally:
+        imageIO.png.numpy = numpy_module
+    if numpy_module is None:
+        sys.exit("numpy is not installed, there is nothing to compare the pure python loops with")
+
+    for ((key, data), rows) in zip(images, expected):
+        for unfilter_batch_bytes in (1, 777, 2**20):
+            for decoded in decodePNGRows(data, unfilter_batch_bytes):
+                if decoded != rows:
+                    sys.exit("colour type {}, bit depth {}, interlace {}, {}x{}, {} byte batches: numpy unfiltering "
+                             "differs from the pure python loops".format(*key, unfilter_batch_bytes))
+
+    print("{} randomly filtered pngs unfiltered identically by numpy (read and read_ndarray) and pure python".format(
+        len(images)))
+
+
+# the per-byte channel split that readRGBImageToSeparatePixelArrays used to do, kept as the baseline
+def legacyReadRGBImageToSeparatePixelArrays(input_filename):
+
+    image_reader = imageIO.png.Reader(filename=input_filename)
+    (image_width, image_height, rgb_image_rows, rgb_image_info) = image_reader.read()
+
+    pixel_array_r = []
+    pixel_array_g = []
+    pixel_array_b = []
+
+    for row in rgb_image_rows:
+        pixel_row_r = []
+        pixel_row_g = []
+        pixel_row_b = []
+        r = 0
+        g = 0
+        b = 0
+        for elem in range(len(row)):
+            if elem % 3 == 0:
+                r = row[elem]
+            elif elem % 3 == 1:
+                g = row[elem]
+            else:
+                b = row[elem]
+                pixel_row_r.append(r)
+                pixel_row_g.append(g)
+                pixel_row_b.append(b)
+
+        pixel_array_r.append(pixel_row_r)
+        pixel_array_g.append(pixel_row_g)
+        pixel_array_b.append(pixel_row_b)
+
+    return (image_width, image_height, pixel_array_r, pixel_array_g, pixel_array_b)
+
+
+# png decoding plus the split into r, g, b pixel arrays
+def benchmarkChannelSplit():
+
+    for image_name in BENCHMARK_IMAGES:
+        baseline = timeBest(legacyReadRGBImageToSeparatePixelArrays, (image_name,))
+        new = timeBest(CS373LicensePlateDetection.readRGBImageToSeparatePixelArrays, (image_name,))
+        printComparison(image_name, baseline, new)
+
+
+# returns the peak number of bytes allocated by python while running function(*args)
+def peakMemory(function, args):
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        try:
+            function(*args)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+
+def readViaRGBChannels(input_filename):
+
+    (image_width, image_height, px_array_r, px_array_g, px_array_b) = \
+        CS373LicensePlateDetection.readRGBImageToSeparatePixelArrays(input_filename)
+    return CS373LicensePlateDetection.computeRGBToGreyscale(px_array_r, px_array_g, px_array_b, image_width, image_height)
+
+
+# reading a greyscale pixel array: r, g, b split followed by conversion, against decoding straight to luma
+def benchmarkGreyscaleRead():
+
+    for image_name in BENCHMARK_IMAGES:
+        baseline = timeBest(readViaRGBChannels, (image_name,), repeats=1)
+        new = timeBest(CS373LicensePlateDetection.readGreyscaleImageToPixelArray, (image_name,), repeats=1)
+        printComparison(image_name, baseline, new)
+        print("{:20s} peak memory before {:6.1f}MB  after {:6.1f}MB".format(
+            "", peakMemory(readViaRGBChannels, (image_name,)) / 2**20,
+            peakMemory(CS373LicensePlateDetection.readGreyscaleImageToPixelArray, (image_name,)) / 2**20))
+
+
+# the pop/insert per pixel greyscale conversion that computeRGBToGreyscale used to do, kept as the baseline
+def legacyComputeRGBToGreyscale(pixel_array_r, pixel_array_g, pixel_array_b, image_width, image_height):
+
+    greyscale_pixel_array = CS373LicensePlateDetection.createInitializedGreyscalePixelArray(image_width, image_height)
+
+    for i in range(0, image_height):
+        for j in range(0, image_width):
+            red = pixel_array_r[i][j]
+            green = pixel_array_g[i][j]
+            blue = pixel_array_b[i][j]
+            grey = round((0.299*red)+(0.587*green)+(0.114*blue))
+            greyscale_pixel_array[i].pop(j)
+            greyscale_pixel_array[i].insert(j, grey)
+
+    return greyscale_pixel_array
+
+
+# greyscale conversion of the r, g, b arrays, checking the new output against the old one as it goes
+def benchmarkGreyscaleConversion():
+
+    for image_name in BENCHMARK_IMAGES:
+        with contextlib.redirect_stdout(io.StringIO()):
+            arrays = CS373LicensePlateDetection.readRGBImageToSeparatePixelArrays(image_name)
+        (image_width, image_height, px_array_r, px_array_g, px_array_b) = arrays
+        args = (px_array_r, px_array_g, px_array_b, image_width, image_height)
+
+        legacy = legacyComputeRGBToGreyscale(*args)
+        if CS373LicensePlateDetection.computeRGBToGreyscale(*args) != legacy:
+            sys.exit("{}: greyscale conversion differs from the old implementation".format(image_name))
+        lut = CS373LicensePlateDetection.computeRGBToGreyscale(*args, integer_lut=True)
+        differences = sum(a != b for legacy_row, lut_row in zip(legacy, lut) for a, b in zip(legacy_row, lut_row))
+        if max(abs(a - b) for legacy_row, lut_row in zip(legacy, lut) for a, b in zip(legacy_row, lut_row)) > 1:
+            sys.exit("{}: integer greyscale conversion is off by more than one".format(image_name))
+
+        baseline = timeBest(legacyComputeRGBToGreyscale, args, repeats=1)
+        printComparison(image_name, baseline, timeBest(CS373LicensePlateDetection.computeRGBToGreyscale, args))
+        printComparison("  integer lut", baseline,
+                        timeBest(CS373LicensePlateDetection.computeRGBToGreyscale, args + (True,)))
+        print("{:20s} integer lut differs by one on {} pixels".format("", differences))
+
+
+# the two pass, float division per pixel contrastStretch, kept as the baseline
+def legacyContrastStretch(pixel_array, image_width, image_height):
+
+    adjarray = CS373LicensePlateDetection.createInitializedGreyscalePixelArray(image_width, image_height)
+    mini = 255
+    maxi = 0
+    for i in range(image_height):
+        mini = min(mini, min(pixel_array[i]))
+        maxi = max(maxi, max(pixel_array[i]))
+
+    for k in range(image_height):
+        for l in range(image_width):
+            num = int(pixel_array[k][l])
+            s = 255*((num-mini)/(maxi-mini))
+            if(s>maxi):
+                adjarray[k][l]=255
+            elif(s<mini):
+                adjarray[k][l]=0
+            else:
+                adjarray[k][l]=s
+    return adjarray
+
+
+# contrast stretching of the greyscale image and of its standard deviation image, checked against the old version
+def benchmarkContrastStretch():
+
+    for image_name in BENCHMARK_IMAGES:
+        with contextlib.redirect_stdout(io.StringIO()):
+            (image_width, image_height, greyscale) = \
+                CS373LicensePlateDetection.readGreyscaleImageToPixelArray(image_name)
+        stretched = CS373LicensePlateDetection.contrastStretch(greyscale, image_width, image_height)
+        edge = CS373LicensePlateDetection.computeStandardDeviationImage5x5(stretched, image_width, image_height)
+
+        for name, pixel_array in (("grey", greyscale), ("stdev", edge)):
+            args = (pixel_array, image_width, image_height)
+            if CS373LicensePlateDetection.contrastStretch(*args) != legacyContrastStretch(*args):
+                sys.exit("{}: {} contrast stretch differs from the old implementation".format(image_name, name))
+            printComparison("{} {}".format(image_name, name), timeBest(legacyContrastStretch, args),
+                            timeBest(CS373LicensePlateDetection.contrastStretch, args))
+
+
+# the percentile bounds of a pixel array found by sorting all its pixels, the baseline for the histogram walk
+# with the ranks computePercentileBins uses: the lower bound is the first value with more than lower_percentile % of
+# the pixels at or below it, the upper bound the first value with at least upper_percentile % at or below it
+# (when that puts the lower bound above the upper one, as for equal percentiles, both are the upper bound)
+def sortedPercentileValues(pixel_array, image_width, image_height, lower_percentile, upper_percentile):
+
+    values = sorted(value for row in pixel_array[:image_height] for value in row[:image_width])
+    upper_rank = min(max(math.ceil(len(values) * upper_percentile / 100) - 1, 0), len(values) - 1)
+    lower_rank = min(int(len(values) * lower_percentile / 100), upper_rank)
+    return (values[lower_rank], values[upper_rank])
+
+
+def histogramPercentileValues(pixel_array, image_width, image_height, lower_percentile, upper_percentile):
+
+    histogram = CS373LicensePlateDetection.computeHistogram(pixel_array, image_width, image_height)
+    return CS373LicensePlateDetection.computePercentileBins(histogram, lower_percentile, upper_percentile)
+
+
+# 5th and 95th percentile of the greyscale image, from the histogram against sorting the pixels
+# a uniform 0..99 row first, where the percentiles fall exactly on a rank, so the check covers the boundary
+# (5 and 94 for 5 and 95: five pixels below the lower bound and five above the upper one)
+def benchmarkPercentiles():
+
+    uniform = [list(range(100))]
+    for (lower_percentile, upper_percentile) in ((5, 95), (0, 100), (0, 0), (50, 50), (1, 99), (2.5, 97.5)):
+        args = (uniform, 100, 1, lower_percentile, upper_percentile)
+        if histogramPercentileValues(*args) != sortedPercentileValues(*args):
+            sys.exit("0..99, {} and {} percentiles: histogram percentiles {} differ from the sorted pixel values "
+                     "{}".format(lower_percentile, upper_percentile, histogramPercentileValues(*args),
+                                 sortedPercentileValues(*args)))
+    if sortedPercentileValues(uniform, 100, 1, 5, 95) != (5, 94):
+        sys.exit("0..99: 5th and 95th percentiles are not 5 and 94")
+
+    for image_name in BENCHMARK_IMAGES:
+        with contextlib.redirect_stdout(io.StringIO()):
+            (image_width, image_height, greyscale) = \
+                CS373LicensePlateDetection.readGreyscaleImageToPixelArray(image_name)
+        args = (greyscale, image_width, image_height, 5, 95)
+        if histogramPercentileValues(*args) != sortedPercentileValues(*args):
+            sys.exit("{}: histogram percentiles differ from the sorted pixel values".format(image_name))
+        printComparison(image_name, timeBest(sortedPercentileValues, args), timeBest(histogramPercentileValues, args))
+
+
+# greyscale to thresholded mask as separate stages, each building a full image
+def stagedEdgeMask(greyscale, image_width, image_height):
+
+    contrast = CS373LicensePlateDetection.contrastStretch(greyscale, image_width, image_height)
+    edge = CS373LicensePlateDetection.computeStandardDeviationImage5x5(contrast, image_width, image_height)
+    edgecontrast = CS373LicensePlateDetection.contrastStretch(edge, image_width, image_height)
+    return CS373LicensePlateDetection.simpleThresholding(edgecontrast, image_width, image_height, packed=True)
+
+
+# the staged front end against the fused computeEdgeMask kernel, time and peak memory, checking the masks match
+def benchmarkFusedEdgeMask():
+
+    for image_name in BENCHMARK_IMAGES:
+        with contextlib.redirect_stdout(io.StringIO()):
+            (image_width, image_height, greyscale) = \
+                CS373LicensePlateDetection.readGreyscaleImageToPixelArray(image_name)
+        args = (greyscale, image_width, image_height)
+        (mask, threshold) = CS373LicensePlateDetection.computeEdgeMask(*args)
+        if mask != stagedEdgeMask(*args):
+            sys.exit("{}: fused edge mask differs from the staged one".format(image_name))
+        printComparison(image_name, timeBest(stagedEdgeMask, args, repeats=1),
+                        timeBest(CS373LicensePlateDetection.computeEdgeMask, args, repeats=1))
+        print("{:20s} peak memory before {:6.1f}MB  after {:6.1f}MB".format(
+            "", peakMemory(stagedEdgeMask, args) / 2**20,
+            peakMemory(CS373LicensePlateDetection.computeEdgeMask, args) / 2**20))
+
+
+# the closed plate mask as main builds it: read the whole image, fused edge mask, then closing
+def stagedClosedEdgeMask(input_filename):
+
+    (image_width, image_height, greyscale) = \
+        CS373LicensePlateDetection.readGreyscaleImageToPixelArray(input_filename, compact=True)
+    (mask, threshold) = CS373LicensePlateDetection.computeEdgeMask(greyscale, image_width, image_height)
+    dilated = CS373LicensePlateDetection.diluteImage(mask, image_width, image_height, 3, 4)
+    return CS373LicensePlateDetection.erodeImage(dilated, image_width, image_height, 3, 4)
+
+
+# the streaming row pipeline against reading the whole image first, given the stretch bounds of the staged run
+def benchmarkStreaming():
+
+    for image_name in BENCHMARK_IMAGES:
+        with contextlib.redirect_stdout(io.StringIO()):
+            (image_width, image_height, greyscale) = \
+                CS373LicensePlateDetection.readGreyscaleImageToPixelArray(image_name)
+        grey_bounds = (min(map(min, greyscale)), max(map(max, greyscale)))
+        contrast = CS373LicensePlateDetection.contrastStretch(greyscale, image_width, image_height)
+        edge = CS373LicensePlateDetection.computeStandardDeviationImage5x5(contrast, image_width, image_height)
+        edge_bounds = (min(map(min, edge)), max(map(max, edge)))
+
+        args = (image_name, grey_bounds, edge_bounds)
+        with contextlib.redirect_stdout(io.StringIO()):
+            staged = stagedClosedEdgeMask(image_name)
+        if CS373LicensePlateDetection.streamClosedEdgeMask(*args) != staged:
+            sys.exit("{}: streamed mask differs from the staged one".format(image_name))
+        printComparison(image_name, timeBest(stagedClosedEdgeMask, (image_name,), repeats=1),
+                        timeBest(CS373LicensePlateDetection.streamClosedEdgeMask, args, repeats=1))
+        print("{:20s} peak memory before {:6.1f}MB  after {:6.1f}MB".format(
+            "", peakMemory(stagedClosedEdgeMask, (image_name,)) / 2**20,
+            peakMemory(CS373LicensePlateDetection.streamClosedEdgeMask, args) / 2**20))
+
+
+# the output image as main used to write it: the detection axes of a matplotlib figure saved at 600 dpi
+def savefigDetectionImage(input_filename, bbox, output_filename):
+
+    from matplotlib import pyplot
+    from matplotlib.patches import Rectangle
+
+    (image_width, image_height, greyscale) = CS373LicensePlateDetection.readGreyscaleImageToPixelArray(input_filename)
+    (min_x, min_y, max_x, max_y) = bbox
+    fig1, axs1 = pyplot.subplots(2, 2)
+    axs1[1, 1].set_title('Final image of detection')
+    axs1[1, 1].imshow(greyscale, cmap='gray')
+    axs1[1, 1].add_patch(Rectangle((min_x, min_y), max_x - min_x, max_y - min_y, linewidth=1,
+                                   edgecolor='g', facecolor='none'))
+    extent = axs1[1, 1].get_window_extent().transformed(fig1.dpi_scale_trans.inverted())
+    pyplot.savefig(output_filename, bbox_inches=extent, dpi=600)
+    pyplot.close(fig1)
+
+
+# writing the detection result image with matplotlib against drawing the box into the png rows, time and file size
+def benchmarkRender():
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        before_filename = os.path.join(output_dir, "before.png")
+        after_filename = os.path.join(output_dir, "after.png")
+        for image_name in BENCHMARK_IMAGES:
+            bbox = CS373LicensePlateDetection.detectLicensePlate(image_name).bbox
+            printComparison(image_name, timeBest(savefigDetectionImage, (image_name, bbox, before_filename), repeats=1),
+                            timeBest(CS373LicensePlateDetection.renderDetectionImage,
+                                     (image_name, bbox, after_filename), repeats=1))
+            print("{:20s} file size before {:6.1f}MB  after {:6.1f}MB".format(
+                "", os.path.getsize(before_filename) / 2**20, os.path.getsize(after_filename) / 2**20))
+
+
+# runs python -X importtime on an import statement, returning the import time lines as
+# (self microseconds, cumulative microseconds, nesting depth, module name), in the order python reports them
+# bytecode writing is left on, so after the first run the numbers are those of an installed copy
+def measureImportTime(statement):
+
+    environment = dict(os.environ)
+    environment.pop("PYTHONDONTWRITEBYTECODE", None)
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], env=environment,
+                               cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+                               check=True)
+    modules = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        (self_time, cumulative_time, name) = line[len("import time:"):].split("|")
+        modules.append((int(self_time), int(cumulative_time), (len(name) - len(name.lstrip()) - 1) // 2,
+                        name.strip()))
+    return modules
+
+
+# cold start of the detection module (best of a few python -X importtime runs) and its slowest direct imports,
+# next to the time the detection itself takes on the smallest bundled image
+def benchmarkImportTime(repeats=5):
+
+    runs = [measureImportTime("import CS373LicensePlateDetection") for i in range(repeats + 1)][1:]
+    best = min(runs, key=lambda modules: modules[-1][1])
+    print("{:40s} {:8.1f}ms".format("import CS373LicensePlateDetection", best[-1][1] / 1000))
+    direct = [module for module in best if module[2] == 1]
+    for (self_time, cumulative_time, depth, name) in sorted(direct, reverse=True, key=lambda module: module[1])[:5]:
+        print("  {:38s} {:8.1f}ms".format(name, cumulative_time / 1000))
+    print("{:40s} {!s:>8}".format("numpy loaded at import", any(module[3] == "numpy" for module in best)))
+    print("{:40s} {!s:>8}".format("matplotlib loaded at import", any(module[3] == "matplotlib" for module in best)))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        detection = CS373LicensePlateDetection.detectLicensePlate("numberplate5.png")
+    print("{:40s} {:8.1f}ms".format("detection of numberplate5.png", detection.timings["total"] * 1000))
+
+
+# writes 8 bit rows to an in-memory png, returning the encoded bytes
+def encodePNG(rows, image_width, image_height, greyscale=False, filter_type=None):
+
+    output = io.BytesIO()
+    imageIO.png.Writer(image_width, image_height, greyscale=greyscale, bitdepth=8,
+                       filter_type=filter_type).write(output, rows)
+    return output.getvalue()
+
+
+# file size and encoding time of the bundled images (rgb) and their closed edge masks (greyscale) without filtering
+# and with a filter chosen per row; every encoding is read back, and the pure python filter selection is timed and
+# checked against the vectorised one on the smallest image
+def benchmarkPNGFilters():
+
+    for image_name in BENCHMARK_IMAGES:
+        with contextlib.redirect_stdout(io.StringIO()):
+            detection = CS373LicensePlateDetection.detectLicensePlate(image_name)
+        (image_width, image_height, rows, info) = imageIO.png.Reader(filename=image_name).asRGB8()
+        pictures = [("rgb", [bytearray(row) for row in rows], False),
+                    ("mask", [bytearray(row) for row in detection.closed.toPixelArray()], True)]
+        for (kind, rows, greyscale) in pictures:
+            unfiltered = encodePNG(rows, image_width, image_height, greyscale, 0)
+            filtered = encodePNG(rows, image_width, image_height, greyscale)
+            for data in (unfiltered, filtered):
+                if [bytearray(row) for row in imageIO.png.Reader(bytes=data).read()[2]] != rows:
+                    sys.exit("{} {}: png does not read back as the original rows".format(image_name, kind))
+            printComparison("{} {}".format(image_name, kind),
+                            timeBest(encodePNG, (rows, image_width, image_height, greyscale, 0)),
+                            timeBest(encodePNG, (rows, image_width, image_height, greyscale)))
+            print("{:20s} file size before {:7.1f}KB  after {:7.1f}KB  smaller {:6.2f}x".format(
+                "", len(unfiltered) / 2**10, len(filtered) / 2**10, len(unfiltered) / len(filtered)))
+
+    (image_width, image_height, rows, info) = imageIO.png.Reader(filename="numberplate5.png").asRGB8()
+    rows = [bytearray(row) for row in rows]
+    vectorised = encodePNG(rows, image_width, image_height)
+    vectorised_seconds = timeBest(encodePNG, (rows, image_width, image_height), repeats=1)
+    numpy_module = imageIO.png.import_numpy()
+    imageIO.png.numpy = None
+    try:
+        pure_python = encodePNG(rows, image_width, image_height)
+        pure_python_seconds = timeBest(encodePNG, (rows, image_width, image_height), repeats=1)
+    finally:
+        imageIO.png.numpy = numpy_module
+    if pure_python != vectorised:
+        sys.exit("numberplate5.png: pure python filtering differs from the vectorised filtering")
+    printComparison("  python/numpy", pure_python_seconds, vectorised_seconds)
+
+
+# writes unfiltered 8 bit rgb rows to an in-memory png with the given number of compression threads
+def encodePNGParallel(rows, image_width, image_height, compression_workers):
+
+    output = io.BytesIO()
+    imageIO.png.Writer(image_width, image_height, greyscale=False, bitdepth=8, filter_type=0,
+                       compression_workers=compression_workers).write(output, rows)
+    return output.getvalue()
+
+
+# idat compression throughput and file size of a 3x3 tiling of numberplate1.png with a single compression stream
+# against compressing blocks on a thread pool; every encoding is read back
+# the rows are left unfiltered so that the time is all compression
+def benchmarkPNGCompressionThreads(tiles=3):
+
+    (image_width, image_height, rows, info) = imageIO.png.Reader(filename="numberplate1.png").asRGB8()
+    rows = [bytearray(row) * tiles for row in rows] * tiles
+    (image_width, image_height) = (image_width * tiles, image_height * tiles)
+    megabytes = image_width * image_height * 3 / 2**20
+    print("{}x{} rgb, {:.1f}MB of pixels, {} cpus".format(image_width, image_height, megabytes, os.cpu_count()))
+
+    single = encodePNGParallel(rows, image_width, image_height, None)
+    single_seconds = timeBest(encodePNGParallel, (rows, image_width, image_height, None))
+    print("{:20s} {:8.3f}s  {:7.1f}MB/s  file size {:6.2f}MB".format(
+        "  single stream", single_seconds, megabytes / single_seconds, len(single) / 2**20))
+    for workers in sorted({2, 4, os.cpu_count() or 1} - {1}):
+        parallel = encodePNGParallel(rows, image_width, image_height, workers)
+        if [bytearray(row) for row in imageIO.png.Reader(bytes=parallel).read()[2]] != rows:
+            sys.exit("{} threads: png does not read back as the original rows".format(workers))
+        seconds = timeBest(encodePNGParallel, (rows, image_width, image_height, workers))
+        print("{:20s} {:8.3f}s  {:7.1f}MB/s  file size {:6.2f}MB  speedup {:5.1f}x  larger {:5.2f}%".format(
+            "  {} threads".format(workers), seconds, megabytes / seconds, len(parallel) / 2**20,
+            single_seconds / seconds, (len(parallel) / len(single) - 1) * 100))
+
+
+# walks every chunk of a png, returning the number of chunk data bytes
+def readPNGChunks(input_filename, use_mmap):
+
+    return sum(len(data) for (chunk_type, data) in
+               imageIO.png.Reader(filename=input_filename, use_mmap=use_mmap).chunks())
+
+
+# decodes a png, returning the rows
+def readPNGRows(input_filename, use_mmap):
+
+    return list(imageIO.png.Reader(filename=input_filename, use_mmap=use_mmap).read()[2])
+
+
+# reading a 3x3 tiling of numberplate1.png from a file against reading it from a memory mapping, once written as
+# 1MB IDAT chunks and once as 8KB IDAT chunks, both walking the chunks alone and decoding every row
+def benchmarkPNGMmap(tiles=3):
+
+    (image_width, image_height, rows, info) = imageIO.png.Reader(filename="numberplate1.png").asRGB8()
+    rows = [bytearray(row) * tiles for row in rows] * tiles
+    (image_width, image_height) = (image_width * tiles, image_height * tiles)
+    with tempfile.TemporaryDirectory() as output_dir:
+        for chunk_limit in (2**20, 2**13):
+            filename = os.path.join(output_dir, "tiled.png")
+            with open(filename, "wb") as output_file:
+                imageIO.png.Writer(image_width, image_height, greyscale=False, bitdepth=8,
+                                   chunk_limit=chunk_limit).write(output_file, rows)
+            if readPNGRows(filename, True) != readPNGRows(filename, False):
+                sys.exit("{} byte chunks: mapped png does not read back as the same rows".format(chunk_limit))
+            print("{}x{} rgb, {:.1f}MB file, {}KB IDAT chunks".format(
+                image_width, image_height, os.path.getsize(filename) / 2**20, chunk_limit // 2**10))
+            printComparison("  chunks", timeBest(readPNGChunks, (filename, False), repeats=5),
+                            timeBest(readPNGChunks, (filename, True), repeats=5))
+            printComparison("  read", timeBest(readPNGRows, (filename, False)),
+                            timeBest(readPNGRows, (filename, True)))
+
+
+# a random binary mask, dense enough to give a mix of small and large components
+def randomMask(image_width, image_height, generator, density=0.45):
+
+    return [[255 if generator.random() < density else 0 for j in range(image_width)] for i in range(image_height)]
+
+
+# labels many random masks at once from a thread pool and checks every result against labeling the mask alone
+# any state shared between calls shows up as a wrong label or size in one of the results
+def benchmarkLabelingThreads(mask_count=48, rounds=5):
+
+    generator = random.Random(373)
+    masks = [(randomMask(w, h, generator), w, h)
+             for (w, h) in ((generator.randint(1, 120), generator.randint(1, 90)) for i in range(mask_count))]
+
+    start = time.perf_counter()
+    expected = [CS373LicensePlateDetection.computeConnectedComponentStatistics(*mask) for mask in masks]
+    expected_bfs = [CS373LicensePlateDetection.computeConnectedComponentLabeling(*mask) for mask in masks]
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for round_number in range(rounds):
+        if CS373LicensePlateDetection.computeConnectedComponentStatisticsBatch(masks, max_workers=8) != expected:
+            sys.exit("round {}: threaded labeling differs from sequential labeling".format(round_number))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(CS373LicensePlateDetection.computeConnectedComponentLabeling, *zip(*masks)))
+        if results != expected_bfs:
+            sys.exit("round {}: threaded bfs labeling differs from sequential labeling".format(round_number))
+    threaded = (time.perf_counter() - start) / rounds
+
+    print("{} masks, {} rounds without cross-talk".format(mask_count, rounds))
+    printComparison("  sequential/threads", sequential, threaded)
+
+
+BENCHMARKS = {
+    "unfilter-parity": benchmarkUnfilterParity,
+    "split": benchmarkChannelSplit,
+    "greyscale-read": benchmarkGreyscaleRead,
+    "greyscale": benchmarkGreyscaleConversion,
+    "contrast": benchmarkContrastStretch,
+    "percentiles": benchmarkPercentiles,
+    "fused": benchmarkFusedEdgeMask,
+    "streaming": benchmarkStreaming,
+    "render": benchmarkRender,
+    "import-time": benchmarkImportTime,
+    "png-filters": benchmarkPNGFilters,
+    "png-compression-threads": benchmarkPNGCompressionThreads,
+    "png-mmap": benchmarkPNGMmap,
+    "labeling-threads": benchmarkLabelingThreads,
+}
+
+
+# usage: python CS373Benchmarks.py [benchmark name ...]
+# without arguments all benchmarks are run
+def main():
+
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            sys.exit("unknown benchmark {}, choose from {}".format(name, ", ".join(BENCHMARKS)))
+        print("== {}".format(name))
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ from matplotlib import pyplot
 
 # import our basic, light-weight png reader library
 import imageIO.png
+import CS373LicensePlateDetection
 
 # this function reads an RGB color png file and returns width, height, as well as pixel arrays for r,g,b
 def readRGBImageToSeparatePixelArrays(input_filename):
@@ -50,18 +51,11 @@ def createInitializedGreyscalePixelArray(image_width, image_height, initValue =
 
 
 
+# nr_bins equal width bins over the 8 bit range 0 to 255, e.g. 64 bins are 4 values wide
+# the counting is done by the histogram engine of the licence plate detection pipeline
 def computeHistogram(pixel_array, image_width, image_height, nr_bins):
 
-    histogram = [0.0 for i in range(nr_bins)]
-
-    # your task to compute the correct histogram!
-
-    # incorrect histogram
-    histogram[0] = 10
-    histogram[32] = 15
-    histogram[63] = 10
-
-    return histogram
+    return CS373LicensePlateDetection.computeHistogram(pixel_array, image_width, image_height, nr_bins)
 
 
 def main():
@@ -77,10 +71,10 @@ def main():
     axs1[0].imshow(pixel_array, cmap='gray')
 
     nr_bins = 64
-    dummy_histogram = computeHistogram(pixel_array, image_width, image_height, nr_bins)
+    histogram = computeHistogram(pixel_array, image_width, image_height, nr_bins)
 
     axs1[1].set_title('Histogram')
-    axs1[1].bar(range(nr_bins), dummy_histogram)
+    axs1[1].bar(range(nr_bins), histogram)
 
     pyplot.show()
 
@@ -1,20 +1,31 @@
+import collections
+import itertools
 import math
-from pyexpat.errors import XML_ERROR_DUPLICATE_ATTRIBUTE
+import re
 import sys
+import time
 from pathlib import Path
 
-from matplotlib import pyplot
-from matplotlib.patches import Rectangle
-
 # import our basic, light-weight png reader library
 import imageIO.png
 
-# this function reads an RGB color png file and returns width, height, as well as pixel arrays for r,g,b
-def readRGBImageToSeparatePixelArrays(input_filename):
+# numpy is optional, some stages have a faster path when it is installed
+# those stages get it from imageIO.png.import_numpy, which only imports it the first time one of them runs, so start
+# up stays fast, and gives None when numpy can't be imported
+
+# this function reads a png file and returns width, height, as well as pixel arrays for r,g,b
+# greyscale, palette and 16 bit images are converted to 8 bit RGB by the png reader, an alpha channel is dropped
+# with compact=True every row is a bytearray (one byte per pixel) instead of a list of ints
+def readRGBImageToSeparatePixelArrays(input_filename, compact=False):
 
     image_reader = imageIO.png.Reader(filename=input_filename)
+    image_reader.preamble()
     # png reader gives us width and height, as well as RGB data in image_rows (a list of rows of RGB triplets)
-    (image_width, image_height, rgb_image_rows, rgb_image_info) = image_reader.read()
+    if image_reader.alpha or image_reader.trns:
+        (image_width, image_height, rgb_image_rows, rgb_image_info) = image_reader.asRGBA8()
+    else:
+        (image_width, image_height, rgb_image_rows, rgb_image_info) = image_reader.asRGB8()
+    planes = rgb_image_info['planes']
 
     print("read image width={}, height={}".format(image_width, image_height))
 
@@ -23,619 +34,681 @@ def readRGBImageToSeparatePixelArrays(input_filename):
     pixel_array_g = []
     pixel_array_b = []
 
+    pixel_row_type = bytearray if compact else list
     for row in rgb_image_rows:
-        pixel_row_r = []
-        pixel_row_g = []
-        pixel_row_b = []
-        r = 0
-        g = 0
-        b = 0
-        for elem in range(len(row)):
-            # RGB triplets are stored consecutively in image_rows
-            if elem % 3 == 0:
-                r = row[elem]
-            elif elem % 3 == 1:
-                g = row[elem]
-            else:
-                b = row[elem]
-                pixel_row_r.append(r)
-                pixel_row_g.append(g)
-                pixel_row_b.append(b)
-
-        pixel_array_r.append(pixel_row_r)
-        pixel_array_g.append(pixel_row_g)
-        pixel_array_b.append(pixel_row_b)
+        # the values of a pixel are stored consecutively in image_rows,
+        # so each channel is a strided slice of the row
+        pixel_array_r.append(pixel_row_type(row[0::planes]))
+        pixel_array_g.append(pixel_row_type(row[1::planes]))
+        pixel_array_b.append(pixel_row_type(row[2::planes]))
 
     return (image_width, image_height, pixel_array_r, pixel_array_g, pixel_array_b)
 
 
+# this function reads a png file straight into a greyscale pixel array and returns width, height and the array
+# the png reader converts each row to greyscale (0.299 r + 0.587 g + 0.114 b) while decoding,
+# which gives the same values as readRGBImageToSeparatePixelArrays followed by computeRGBToGreyscale
+# without ever holding the r, g, b arrays
+def readGreyscaleImageToPixelArray(input_filename, compact=False):
+
+    image_reader = imageIO.png.Reader(filename=input_filename)
+    (image_width, image_height, greyscale_image_rows, greyscale_image_info) = image_reader.asLuma8()
+
+    print("read image width={}, height={}".format(image_width, image_height))
+
+    pixel_row_type = bytearray if compact else list
+    greyscale_pixel_array = [pixel_row_type(row) for row in greyscale_image_rows]
+
+    return (image_width, image_height, greyscale_pixel_array)
+
+
 # a useful shortcut method to create a list of lists based array representation for an image, initialized with a value
 def createInitializedGreyscalePixelArray(image_width, image_height, initValue = 0):
 
     new_array = [[initValue for x in range(image_width)] for y in range(image_height)]
     return new_array
 
-def computeRGBToGreyscale(pixel_array_r, pixel_array_g, pixel_array_b, image_width, image_height):
-    
-    greyscale_pixel_array = createInitializedGreyscalePixelArray(image_width, image_height)
-    
+# fixed point weight tables for the integer greyscale conversion: the weights 0.299, 0.587 and 0.114 scaled by 1000
+# the red table also carries the +500 that rounds the sum to the nearest integer when dividing by 1000
+RED_WEIGHT_TABLE = [299 * value + 500 for value in range(256)]
+GREEN_WEIGHT_TABLE = [587 * value for value in range(256)]
+BLUE_WEIGHT_TABLE = [114 * value for value in range(256)]
+
+# with integer_lut=True the conversion is three table lookups and an integer division per pixel
+# it matches the floating point conversion except for exact halves (about 0.06% of all colours),
+# which the integer mode always rounds up and the floating point mode rounds either way depending on rounding error
+def computeRGBToGreyscale(pixel_array_r, pixel_array_g, pixel_array_b, image_width, image_height, integer_lut=False):
+
+    greyscale_pixel_array = []
     for i in range(0, image_height):
-        for j in range(0, image_width):
-            red = pixel_array_r[i][j]
-            green = pixel_array_g[i][j]
-            blue = pixel_array_b[i][j]
-            grey = round((0.299*red)+(0.587*green)+(0.114*blue))
-            greyscale_pixel_array[i].pop(j)
-            greyscale_pixel_array[i].insert(j, grey)
+        row_r = pixel_array_r[i]
+        row_g = pixel_array_g[i]
+        row_b = pixel_array_b[i]
+        if integer_lut:
+            greyscale_pixel_array.append([(RED_WEIGHT_TABLE[red] + GREEN_WEIGHT_TABLE[green] + BLUE_WEIGHT_TABLE[blue]) // 1000
+                                          for red, green, blue in zip(row_r, row_g, row_b)])
+        else:
+            greyscale_pixel_array.append([round((0.299*red)+(0.587*green)+(0.114*blue))
+                                          for red, green, blue in zip(row_r, row_g, row_b)])
 
-    
     return greyscale_pixel_array
 
+# maps a row of pixels through a lookup table, returning a list: the value v becomes lut[int(v) - offset]
+# integer rows (lists of 8 bit values, bytes or bytearrays) with offset 0 index the table directly,
+# anything else, like the floats of the standard deviation image, is truncated to int first
+def applyLookupTable(row, lut, offset=0):
+    if offset == 0:
+        try:
+            return list(map(lut.__getitem__, row))
+        except TypeError:
+            pass
+    return [lut[int(value) - offset] for value in row]
+
+# the lookup table of contrastStretch for an image with minimum mini and maximum maxi (maxi > mini):
+# a value v stretches to lut[int(v) - offset], the table covers every integer from 0 (or int(mini), if negative) to maxi
+def createStretchTable(mini, maxi):
+
+    def stretch(num):
+        s = 255*((num-mini)/(maxi-mini))
+        if(s>maxi):
+            return 255
+        elif(s<mini):
+            return 0
+        return s
+
+    offset = min(int(mini), 0)
+    return ([stretch(num) for num in range(offset, int(maxi) + 1)], offset)
+
+# createStretchTable for any minimum and maximum, including a flat image (maxi == mini), which stretches to all 0
+def createRangeStretchTable(mini, maxi):
+    if maxi == mini:
+        offset = min(int(mini), 0)
+        return ([0] * (int(maxi) + 1 - offset), offset)
+    return createStretchTable(mini, maxi)
+
+# stretches the pixel values so that the darkest pixel becomes 0, values are scaled by 255 / (max - min)
+# and clamped: a stretched value above the old maximum becomes 255, one below the old minimum becomes 0
+# pixels are truncated to int before stretching, so 8 bit images and float images (like the standard deviation
+# image) both take their values from a lookup table built once over the integer range between min and max
+# a flat image (max == min) has nothing to stretch and comes out all 0
 def contrastStretch(pixel_array, image_width, image_height):
-    adjarray = createInitializedGreyscalePixelArray(image_width, image_height)
-    mini = 255
-    maxi = 0
-    for i in range(image_height):
-        minimum = min(pixel_array[i])
-        if(minimum<mini):
-            mini = minimum
-        maximum = max(pixel_array[i])
-        if(maximum>maxi):
-            maxi = maximum
-
-    for k in range(image_height):
-        for l in range(image_width):
-            num = int(pixel_array[k][l])
-            s = 255*((num-mini)/(maxi-mini))
-            if(s>maxi):
-                adjarray[k][l]=255
-            elif(s<mini):
-                adjarray[k][l]=0
-            else:
-                adjarray[k][l]=s
-    return adjarray
+    rows = pixel_array[:image_height]
+    mini = min(min(row) for row in rows)
+    maxi = max(max(row) for row in rows)
+    if maxi == mini:
+        return createInitializedGreyscalePixelArray(image_width, image_height)
+
+    (lut, offset) = createStretchTable(mini, maxi)
+    return [applyLookupTable(row, lut, offset) for row in rows]
     
-def stdev5x5(data):
-    n = 25
-    suma = 0
-    for i in range(5):
-        suma += sum(data[i])
-    mean = suma / n
-    deviations =[]
-    for j in range(5):
-        for k in range(5):
-            deviations.append((data[j][k] - mean) ** 2)
-    variance = sum(deviations) / n
-    std_dev = float(math.sqrt(variance))
-    return std_dev
+# counts the pixels in nr_bins equal width bins over [0, value_range), in a single pass over the image
+# a value v goes into bin int(v * nr_bins // value_range), values outside the range go into the first or last bin
+# the python path counts the distinct values row by row and only then folds them into bins, numpy uses bincount
+def computeHistogram(pixel_array, image_width, image_height, nr_bins=256, value_range=256):
+    numpy = imageIO.png.import_numpy()
+    rows = [row[:image_width] for row in pixel_array[:image_height]]
 
-def computeStandardDeviationImage5x5(pixel_array, image_width, image_height):
-    standarddev = createInitializedGreyscalePixelArray(image_width, image_height)
+    if numpy is not None and rows:
+        values = numpy.array(rows, dtype=numpy.float64)
+        bins = numpy.clip(numpy.floor(values * nr_bins / value_range), 0, nr_bins - 1).astype(numpy.intp)
+        return numpy.bincount(bins.ravel(), minlength=nr_bins).tolist()
+
+    counts = collections.Counter()
+    for row in rows:
+        counts.update(row)
+    histogram = [0] * nr_bins
+    for value, count in counts.items():
+        histogram[min(max(int(value * nr_bins // value_range), 0), nr_bins - 1)] += count
+    return histogram
+
+# the bins holding the lower and upper percentile of the pixels, from a walk over the cumulative histogram
+# the lower bin is the first one with more than lower_percentile % of the pixels at or below it,
+# the upper bin is the first one with at least upper_percentile % of the pixels at or below it
+def computePercentileBins(histogram, lower_percentile, upper_percentile):
+    if not 0 <= lower_percentile <= upper_percentile <= 100:
+        raise ValueError("percentiles must satisfy 0 <= lower <= upper <= 100, got {} and {}".format(
+            lower_percentile, upper_percentile))
+    total = sum(histogram)
+    lower_count = total * lower_percentile / 100
+    upper_count = total * upper_percentile / 100
+
+    lower_bin = None
+    upper_bin = len(histogram) - 1
+    cumulative = 0
+    for index, count in enumerate(histogram):
+        cumulative += count
+        if lower_bin is None and cumulative > lower_count:
+            lower_bin = index
+        if cumulative >= upper_count and count > 0:
+            upper_bin = index
+            break
+    if lower_bin is None:
+        lower_bin = upper_bin
+    return (lower_bin, min(max(upper_bin, lower_bin), len(histogram) - 1))
+
+# contrast stretching between percentiles instead of the absolute min and max, so a few outlier pixels
+# don't decide the stretch: the lower percentile value maps to 0, the upper one to 255, everything outside is clamped
+# the bounds come from the histogram in O(nr_bins), bins are 1 wide by default so they are exact for 8 bit images
+# pixel values must be non negative and are truncated to int like in contrastStretch, the result is 8 bit integers
+def percentileContrastStretch(pixel_array, image_width, image_height, lower_percentile=5, upper_percentile=95,
+                              nr_bins=256, value_range=256, histogram=None):
+    if histogram is None:
+        histogram = computeHistogram(pixel_array, image_width, image_height, nr_bins, value_range)
+    (lower_bin, upper_bin) = computePercentileBins(histogram, lower_percentile, upper_percentile)
+    bin_width = value_range / len(histogram)
+    low = lower_bin * bin_width
+    high = upper_bin * bin_width
+    if high <= low:
+        return createInitializedGreyscalePixelArray(image_width, image_height)
+
+    rows = pixel_array[:image_height]
+    maxi = max(max(row) for row in rows)
+    lut = [min(max(round(255 * (num - low) / (high - low)), 0), 255) for num in range(int(maxi) + 1)]
+    return [applyLookupTable(row, lut) for row in rows]
+    
+# standard deviation of every window_size x window_size neighbourhood (window_size must be odd), in O(1) per pixel
+# border policy: pixels outside the image count as 0, and the mean and variance are always taken over
+# window_size * window_size values, so windows that hang over the border are treated as zero padded
+# the window sums come from integral images (summed-area tables) of the pixel values and of their squares
+def computeStandardDeviationImage(pixel_array, image_width, image_height, window_size=5):
+    numpy = imageIO.png.import_numpy()
+
+    if window_size < 1 or window_size % 2 == 0:
+        raise ValueError("window_size must be a positive odd number, got {}".format(window_size))
+    half = window_size // 2
+    window_area = window_size * window_size
+
+    if numpy is not None:
+        values = numpy.array([list(row[:image_width]) for row in pixel_array[:image_height]], dtype=numpy.float64)
+        # zero padding around the image, plus the leading zero row and column of the integral image
+        padded = numpy.zeros((image_height + 2 * half + 1, image_width + 2 * half + 1))
+        padded[half + 1:half + 1 + image_height, half + 1:half + 1 + image_width] = values
+        sums = padded.cumsum(axis=0).cumsum(axis=1)
+        squares = (padded * padded).cumsum(axis=0).cumsum(axis=1)
+
+        def windowSums(table):
+            return (table[window_size:, window_size:] - table[:-window_size, window_size:]
+                    - table[window_size:, :-window_size] + table[:-window_size, :-window_size])
+
+        window_sum = windowSums(sums)
+        variance = (window_area * windowSums(squares) - window_sum * window_sum) / (window_area * window_area)
+        return numpy.sqrt(numpy.maximum(variance, 0.0)).tolist()
+
+    # integral images with a leading zero row and column: sums[i][j] is the sum of all pixels above and left of (i, j)
+    sums = [[0] * (image_width + 1)]
+    squares = [[0] * (image_width + 1)]
     for i in range(image_height):
+        row = pixel_array[i]
+        above_sums = sums[i]
+        above_squares = squares[i]
+        row_sums = [0]
+        row_squares = [0]
+        running_sum = 0
+        running_square = 0
         for j in range(image_width):
-            kernel = createInitializedGreyscalePixelArray(5,5)
-            if(i==0 and j==0):
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[2][4]= pixel_array[i][j+2]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[3][3]= pixel_array[i+1][j+1]
-                kernel[3][4]= pixel_array[i+1][j+2]
-                kernel[4][2]= pixel_array[i+2][j]
-                kernel[4][3]= pixel_array[i+2][j+1]
-                kernel[4][4]= pixel_array[i+2][j+2]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==0 and j==1):
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[2][4]= pixel_array[i][j+2]
-                kernel[3][1]= pixel_array[i+1][j-1]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[3][3]= pixel_array[i+1][j+1]
-                kernel[3][4]= pixel_array[i+1][j+2]
-                kernel[4][1]= pixel_array[i+2][j-1]
-                kernel[4][2]= pixel_array[i+2][j]
-                kernel[4][3]= pixel_array[i+2][j+1]
-                kernel[4][4]= pixel_array[i+2][j+2]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==1 and j==1):
-                kernel[1][1]= pixel_array[i-1][j-1]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[1][3]= pixel_array[i-1][j+1]
-                kernel[1][4]= pixel_array[i-1][j+2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[2][4]= pixel_array[i][j+2]
-                kernel[3][1]= pixel_array[i+1][j-1]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[3][3]= pixel_array[i+1][j+1]
-                kernel[3][4]= pixel_array[i+1][j+2]
-                kernel[4][1]= pixel_array[i+2][j-1]
-                kernel[4][2]= pixel_array[i+2][j]
-                kernel[4][3]= pixel_array[i+2][j+1]
-                kernel[4][4]= pixel_array[i+2][j+2]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==0 and j>1 and j<image_width-2):
-                kernel[2][0]= pixel_array[i][j-2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[2][4]= pixel_array[i][j+2]
-                kernel[3][0]= pixel_array[i+1][j-2]
-                kernel[3][1]= pixel_array[i+1][j-1]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[3][3]= pixel_array[i+1][j+1]
-                kernel[3][4]= pixel_array[i+1][j+2]
-                kernel[4][0]= pixel_array[i+2][j-2]
-                kernel[4][1]= pixel_array[i+2][j-1]
-                kernel[4][2]= pixel_array[i+2][j]
-                kernel[4][3]= pixel_array[i+2][j+1]
-                kernel[4][4]= pixel_array[i+2][j+2]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==0 and j==image_width-2):
-                kernel[2][0]= pixel_array[i][j-2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[3][0]= pixel_array[i+1][j-2]
-                kernel[3][1]= pixel_array[i+1][j-1]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[3][3]= pixel_array[i+1][j+1]
-                kernel[4][0]= pixel_array[i+2][j-2]
-                kernel[4][1]= pixel_array[i+2][j-1]
-                kernel[4][2]= pixel_array[i+2][j]
-                kernel[4][3]= pixel_array[i+2][j+1]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==0 and j==image_width-1):
-                kernel[2][0]= pixel_array[i][j-2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[3][0]= pixel_array[i+1][j-2]
-                kernel[3][1]= pixel_array[i+1][j-1]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[4][0]= pixel_array[i+2][j-2]
-                kernel[4][1]= pixel_array[i+2][j-1]
-                kernel[4][2]= pixel_array[i+2][j]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==1 and j>1 and j<image_width-2):
-                kernel[1][0]= pixel_array[i-1][j-2]
-                kernel[1][1]= pixel_array[i-1][j-1]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[1][3]= pixel_array[i-1][j+1]
-                kernel[1][4]= pixel_array[i-1][j+2]
-                kernel[2][0]= pixel_array[i][j-2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[2][4]= pixel_array[i][j+2]
-                kernel[3][0]= pixel_array[i+1][j-2]
-                kernel[3][1]= pixel_array[i+1][j-1]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[3][3]= pixel_array[i+1][j+1]
-                kernel[3][4]= pixel_array[i+1][j+2]
-                kernel[4][0]= pixel_array[i+2][j-2]
-                kernel[4][1]= pixel_array[i+2][j-1]
-                kernel[4][2]= pixel_array[i+2][j]
-                kernel[4][3]= pixel_array[i+2][j+1]
-                kernel[4][4]= pixel_array[i+2][j+2]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==1 and j==image_width-2):
-                kernel[1][0]= pixel_array[i-1][j-2]
-                kernel[1][1]= pixel_array[i-1][j-1]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[1][3]= pixel_array[i-1][j+1]
-                kernel[2][0]= pixel_array[i][j-2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[3][0]= pixel_array[i+1][j-2]
-                kernel[3][1]= pixel_array[i+1][j-1]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[3][3]= pixel_array[i+1][j+1]
-                kernel[4][0]= pixel_array[i+2][j-2]
-                kernel[4][1]= pixel_array[i+2][j-1]
-                kernel[4][2]= pixel_array[i+2][j]
-                kernel[4][3]= pixel_array[i+2][j+1]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==1 and j==image_width-1):
-                kernel[1][0]= pixel_array[i-1][j-2]
-                kernel[1][1]= pixel_array[i-1][j-1]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[2][0]= pixel_array[i][j-2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[3][0]= pixel_array[i+1][j-2]
-                kernel[3][1]= pixel_array[i+1][j-1]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[4][0]= pixel_array[i+2][j-2]
-                kernel[4][1]= pixel_array[i+2][j-1]
-                kernel[4][2]= pixel_array[i+2][j]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==1 and j==0):
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[1][3]= pixel_array[i-1][j+1]
-                kernel[1][4]= pixel_array[i-1][j+2]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[2][4]= pixel_array[i][j+2]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[3][3]= pixel_array[i+1][j+1]
-                kernel[3][4]= pixel_array[i+1][j+1]
-                kernel[4][2]= pixel_array[i+2][j]
-                kernel[4][3]= pixel_array[i+2][j+1]
-                kernel[4][4]= pixel_array[i+2][j+2]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i>1 and j==0 and i<image_height-2):
-                kernel[0][2]= pixel_array[i-2][j]
-                kernel[0][3]= pixel_array[i-2][j+1]
-                kernel[0][4]= pixel_array[i-2][j+2]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[1][3]= pixel_array[i-1][j+1]
-                kernel[1][4]= pixel_array[i-1][j+2]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[2][4]= pixel_array[i][j+2]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[3][3]= pixel_array[i+1][j+1]
-                kernel[3][4]= pixel_array[i+1][j+2]
-                kernel[4][2]= pixel_array[i+2][j]
-                kernel[4][3]= pixel_array[i+2][j+1]
-                kernel[4][4]= pixel_array[i+2][j+2]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==image_height-2 and j==0):
-                kernel[0][2]= pixel_array[i-2][j]
-                kernel[0][3]= pixel_array[i-2][j+1]
-                kernel[0][4]= pixel_array[i-2][j+2]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[1][3]= pixel_array[i-1][j+1]
-                kernel[1][4]= pixel_array[i-1][j+2]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[2][4]= pixel_array[i][j+2]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[3][3]= pixel_array[i+1][j+1]
-                kernel[3][4]= pixel_array[i+1][j+2]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==image_height-1 and j==0):
-                kernel[0][2]= pixel_array[i-2][j]
-                kernel[0][3]= pixel_array[i-2][j+1]
-                kernel[0][4]= pixel_array[i-2][j+2]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[1][3]= pixel_array[i-1][j+1]
-                kernel[1][4]= pixel_array[i-1][j+2]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[2][4]= pixel_array[i][j+2]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==image_height-1 and j==1):
-                kernel[0][1]= pixel_array[i-2][j-1]
-                kernel[0][2]= pixel_array[i-2][j]
-                kernel[0][3]= pixel_array[i-2][j+1]
-                kernel[0][4]= pixel_array[i-2][j+2]
-                kernel[1][1]= pixel_array[i-1][j-1]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[1][3]= pixel_array[i-1][j+1]
-                kernel[1][4]= pixel_array[i-1][j+2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[2][4]= pixel_array[i][j+2]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==image_height-2 and j==1):
-                kernel[0][1]= pixel_array[i-2][j-1]
-                kernel[0][2]= pixel_array[i-2][j]
-                kernel[0][3]= pixel_array[i-2][j+1]
-                kernel[0][4]= pixel_array[i-2][j+2]
-                kernel[1][1]= pixel_array[i-1][j-1]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[1][3]= pixel_array[i-1][j+1]
-                kernel[1][4]= pixel_array[i-1][j+2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[2][4]= pixel_array[i][j+2]
-                kernel[3][1]= pixel_array[i+1][j-1]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[3][3]= pixel_array[i+1][j+1]
-                kernel[3][4]= pixel_array[i+1][j+2]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i>1 and j==1 and i<image_height-2):
-                kernel[0][1]= pixel_array[i-2][j-1]
-                kernel[0][2]= pixel_array[i-2][j]
-                kernel[0][3]= pixel_array[i-2][j+1]
-                kernel[0][4]= pixel_array[i-2][j+2]
-                kernel[1][1]= pixel_array[i-1][j-1]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[1][3]= pixel_array[i-1][j+1]
-                kernel[1][4]= pixel_array[i-1][j+2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[2][4]= pixel_array[i][j+2]
-                kernel[3][1]= pixel_array[i+1][j-1]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[3][3]= pixel_array[i+1][j+1]
-                kernel[3][4]= pixel_array[i+1][j+2]
-                kernel[4][1]= pixel_array[i+2][j-1]
-                kernel[4][2]= pixel_array[i+2][j]
-                kernel[4][3]= pixel_array[i+2][j+1]
-                kernel[4][4]= pixel_array[i+2][j+2]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==image_height-1 and j>1 and j<image_width-2):
-                kernel[0][0]= pixel_array[i-2][j-2]
-                kernel[0][1]= pixel_array[i-2][j-1]
-                kernel[0][2]= pixel_array[i-2][j]
-                kernel[0][3]= pixel_array[i-2][j+1]
-                kernel[0][4]= pixel_array[i-2][j+2]
-                kernel[1][0]= pixel_array[i-1][j-2]
-                kernel[1][1]= pixel_array[i-1][j-1]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[1][3]= pixel_array[i-1][j+1]
-                kernel[1][4]= pixel_array[i-1][j+2]
-                kernel[2][0]= pixel_array[i][j-2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[2][4]= pixel_array[i][j+2]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==image_height-2 and j>1 and j<image_width-2):
-                kernel[0][0]= pixel_array[i-2][j-2]
-                kernel[0][1]= pixel_array[i-2][j-1]
-                kernel[0][2]= pixel_array[i-2][j]
-                kernel[0][3]= pixel_array[i-2][j+1]
-                kernel[0][4]= pixel_array[i-2][j+2]
-                kernel[1][0]= pixel_array[i-1][j-2]
-                kernel[1][1]= pixel_array[i-1][j-1]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[1][3]= pixel_array[i-1][j+1]
-                kernel[1][4]= pixel_array[i-1][j+2]
-                kernel[2][0]= pixel_array[i][j-2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[2][4]= pixel_array[i][j+2]
-                kernel[3][0]= pixel_array[i+1][j-2]
-                kernel[3][1]= pixel_array[i+1][j-1]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[3][3]= pixel_array[i+1][j+1]
-                kernel[3][4]= pixel_array[i+1][j+2]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==image_height-1 and j==image_width-1):
-                kernel[0][0]= pixel_array[i-2][j-2]
-                kernel[0][1]= pixel_array[i-2][j-1]
-                kernel[0][2]= pixel_array[i-2][j]
-                kernel[1][0]= pixel_array[i-1][j-2]
-                kernel[1][1]= pixel_array[i-1][j-1]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[2][0]= pixel_array[i][j-2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==image_height-1 and j==image_width-2):
-                kernel[0][0]= pixel_array[i-2][j-2]
-                kernel[0][1]= pixel_array[i-2][j-1]
-                kernel[0][2]= pixel_array[i-2][j]
-                kernel[0][3]= pixel_array[i-2][j+1]
-                kernel[1][0]= pixel_array[i-1][j-2]
-                kernel[1][1]= pixel_array[i-1][j-1]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[1][3]= pixel_array[i-1][j+1]
-                kernel[2][0]= pixel_array[i][j-2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==image_height-2 and j==image_width-1):
-                kernel[0][0]= pixel_array[i-2][j-2]
-                kernel[0][1]= pixel_array[i-2][j-1]
-                kernel[0][2]= pixel_array[i-2][j]
-                kernel[1][0]= pixel_array[i-1][j-2]
-                kernel[1][1]= pixel_array[i-1][j-1]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[2][0]= pixel_array[i][j-2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[3][0]= pixel_array[i+1][j-2]
-                kernel[3][1]= pixel_array[i+1][j-1]
-                kernel[3][2]= pixel_array[i+1][j]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i==image_height-2 and j==image_width-2):
-                kernel[0][0]= pixel_array[i-2][j-2]
-                kernel[0][1]= pixel_array[i-2][j-1]
-                kernel[0][2]= pixel_array[i-2][j]
-                kernel[0][3]= pixel_array[i-2][j+1]
-                kernel[1][0]= pixel_array[i-1][j-2]
-                kernel[1][1]= pixel_array[i-1][j-1]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[1][3]= pixel_array[i-1][j+1]
-                kernel[2][0]= pixel_array[i][j-2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[3][0]= pixel_array[i+1][j-2]
-                kernel[3][1]= pixel_array[i+1][j-1]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[3][3]= pixel_array[i+1][j+1]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i>1 and j==image_width-1 and i==image_height-2):
-                kernel[0][0]= pixel_array[i-2][j-2]
-                kernel[0][1]= pixel_array[i-2][j-1]
-                kernel[0][2]= pixel_array[i-2][j]
-                kernel[1][0]= pixel_array[i-1][j-2]
-                kernel[1][1]= pixel_array[i-1][j-1]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[2][0]= pixel_array[i][j-2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[3][0]= pixel_array[i+1][j-2]
-                kernel[3][1]= pixel_array[i+1][j-1]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[4][0]= pixel_array[i+2][j-2]
-                kernel[4][1]= pixel_array[i+2][j-1]
-                kernel[4][2]= pixel_array[i+2][j]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i>1 and j==image_width-2 and i==image_height-2):
-                kernel[0][0]= pixel_array[i-2][j-2]
-                kernel[0][1]= pixel_array[i-2][j-1]
-                kernel[0][2]= pixel_array[i-2][j]
-                kernel[0][3]= pixel_array[i-2][j+1]
-                kernel[1][0]= pixel_array[i-1][j-2]
-                kernel[1][1]= pixel_array[i-1][j-1]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[1][3]= pixel_array[i-1][j+1]
-                kernel[2][0]= pixel_array[i][j-2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[3][0]= pixel_array[i+1][j-2]
-                kernel[3][1]= pixel_array[i+1][j-1]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[3][3]= pixel_array[i+1][j+1]
-                kernel[4][0]= pixel_array[i+2][j-2]
-                kernel[4][1]= pixel_array[i+2][j-1]
-                kernel[4][2]= pixel_array[i+2][j]
-                kernel[4][3]= pixel_array[i+2][j+1]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-            elif(i>1 and j>1 and i<image_height-2 and j<image_width-2):
-                kernel[0][0]= pixel_array[i-2][j-2]
-                kernel[0][1]= pixel_array[i-2][j-1]
-                kernel[0][2]= pixel_array[i-2][j]
-                kernel[0][3]= pixel_array[i-2][j+1]
-                kernel[0][4]= pixel_array[i-2][j+2]
-                kernel[1][0]= pixel_array[i-1][j-2]
-                kernel[1][1]= pixel_array[i-1][j-1]
-                kernel[1][2]= pixel_array[i-1][j]
-                kernel[1][3]= pixel_array[i-1][j+1]
-                kernel[1][4]= pixel_array[i-1][j+2]
-                kernel[2][0]= pixel_array[i][j-2]
-                kernel[2][1]= pixel_array[i][j-1]
-                kernel[2][2]= pixel_array[i][j]
-                kernel[2][3]= pixel_array[i][j+1]
-                kernel[2][4]= pixel_array[i][j+2]
-                kernel[3][0]= pixel_array[i+1][j-2]
-                kernel[3][1]= pixel_array[i+1][j-1]
-                kernel[3][2]= pixel_array[i+1][j]
-                kernel[3][3]= pixel_array[i+1][j+1]
-                kernel[3][4]= pixel_array[i+1][j+2]
-                kernel[4][0]= pixel_array[i+2][j-2]
-                kernel[4][1]= pixel_array[i+2][j-1]
-                kernel[4][2]= pixel_array[i+2][j]
-                kernel[4][3]= pixel_array[i+2][j+1]
-                kernel[4][4]= pixel_array[i+2][j+2]
-                standev = float(stdev5x5(kernel))
-                standarddev[i][j] = standev
-    
+            value = row[j]
+            running_sum += value
+            running_square += value * value
+            row_sums.append(above_sums[j + 1] + running_sum)
+            row_squares.append(above_squares[j + 1] + running_square)
+        sums.append(row_sums)
+        squares.append(row_squares)
+
+    # window columns, clipped to the image
+    lefts = [max(0, j - half) for j in range(image_width)]
+    rights = [min(image_width, j + half + 1) for j in range(image_width)]
+
+    standarddev = []
+    for i in range(image_height):
+        top_sums = sums[max(0, i - half)]
+        bottom_sums = sums[min(image_height, i + half + 1)]
+        top_squares = squares[max(0, i - half)]
+        bottom_squares = squares[min(image_height, i + half + 1)]
+        standarddev_row = []
+        for j in range(image_width):
+            left = lefts[j]
+            right = rights[j]
+            window_sum = bottom_sums[right] - top_sums[right] - bottom_sums[left] + top_sums[left]
+            window_square = bottom_squares[right] - top_squares[right] - bottom_squares[left] + top_squares[left]
+            variance = (window_area * window_square - window_sum * window_sum) / (window_area * window_area)
+            standarddev_row.append(math.sqrt(variance) if variance > 0 else 0.0)
+        standarddev.append(standarddev_row)
+
     return standarddev
 
-def simpleThresholding(pixel_array, image_width, image_height):
+def computeStandardDeviationImage5x5(pixel_array, image_width, image_height):
+    return computeStandardDeviationImage(pixel_array, image_width, image_height, 5)
+
+# a compact binary image: each row is one python int, where bit j is set when pixel j is foreground (non zero)
+# this takes about one bit per pixel instead of a python int reference per pixel, and whole rows can be
+# shifted, ORed and ANDed at once, so the morphology below works on all pixels of a row in a single operation
+class BinaryImage:
+    def __init__(self, image_width, image_height, rows=None):
+        self.width = image_width
+        self.height = image_height
+        if rows is None:
+            rows = [0] * image_height
+        self.rows = rows
+
+    # packs a list of lists pixel array, every non zero pixel becomes foreground
+    @classmethod
+    def fromPixelArray(cls, pixel_array, image_width, image_height):
+        rows = []
+        for i in range(image_height):
+            bits = ''.join('0' if value == 0 else '1' for value in pixel_array[i][image_width - 1::-1])
+            rows.append(int(bits, 2) if bits else 0)
+        return cls(image_width, image_height, rows)
+
+    # unpacks into a list of lists pixel array with the given values for foreground and background
+    def toPixelArray(self, foreground=255, background=0):
+        values = {'0': background, '1': foreground}
+        return [[values[bit] for bit in format(row, '0{}b'.format(self.width))[::-1]] for row in self.rows]
+
+    # bit mask of all the pixels in a row
+    def rowMask(self):
+        return (1 << self.width) - 1
+
+    def __eq__(self, other):
+        return (isinstance(other, BinaryImage) and (self.width, self.height) == (other.width, other.height)
+                and self.rows == other.rows)
+
+# any of the bits within radius of each bit, within one row: the horizontal half of computeBinaryWindowAny, and the
+# horizontal pass of iterMorphologyRows
+def computeRowWindowAny(row, radius, mask):
+    reach = 0
+    while reach < radius:
+        step = min(reach + 1, radius - reach)
+        row = (row | (row << step) | (row >> step)) & mask
+        reach += step
+    return row
+
+# sets each bit of each row when a bit within radius of it (in x and y, clipped to the image) is set
+# the window grows by doubling, so this takes O(log radius) whole-row shifts and ORs per row and per column
+def computeBinaryWindowAny(binary_image, radius):
+    mask = binary_image.rowMask()
+    rows = [computeRowWindowAny(row, radius, mask) for row in binary_image.rows]
+
+    empty = [0] * radius
+    reach = 0
+    while reach < radius:
+        step = min(reach + 1, radius - reach)
+        shifted = empty[:step] + rows + empty[:step]
+        rows = [shifted[i] | shifted[i + step] | shifted[i + 2 * step] for i in range(binary_image.height)]
+        reach += step
+    return BinaryImage(binary_image.width, binary_image.height, rows)
+
+# thresholds at value > threshold to 255 (foreground) and 0 (background)
+# with packed=True the result is returned as a BinaryImage instead of a list of lists
+def simpleThresholding(pixel_array, image_width, image_height, packed=False, threshold=150):
+    if packed:
+        rows = []
+        for i in range(image_height):
+            bits = ''.join('1' if value > threshold else '0' for value in pixel_array[i][image_width - 1::-1])
+            rows.append(int(bits, 2) if bits else 0)
+        return BinaryImage(image_width, image_height, rows)
+
     thres = createInitializedGreyscalePixelArray(image_width, image_height)
     for i in range(image_height):
         for j in range(image_width):
-            if(pixel_array[i][j] > 150):
+            if(pixel_array[i][j] > threshold):
                 thres[i][j]=255
             else:
                 thres[i][j]=0
 
     return thres
 
-def erodeImage(pixel_array, image_width, image_height):
+# Otsu's threshold of a histogram: the bin t for which splitting the pixels into bins <= t and bins > t
+# gives the largest between class variance, found with running sums in O(number of bins)
+# an image with a single occupied bin has nothing to split and gets the last bin, so all of it is background
+def computeOtsuThreshold(histogram):
+    total = sum(histogram)
+    total_sum = sum(index * count for index, count in enumerate(histogram))
+
+    best_threshold = len(histogram) - 1
+    best_variance = 0.0
+    background_count = 0
+    background_sum = 0
+    for index, count in enumerate(histogram):
+        background_count += count
+        background_sum += index * count
+        foreground_count = total - background_count
+        if background_count == 0:
+            continue
+        if foreground_count == 0:
+            break
+        mean_difference = background_sum / background_count - (total_sum - background_sum) / foreground_count
+        variance = background_count * foreground_count * mean_difference * mean_difference
+        if variance > best_variance:
+            best_variance = variance
+            best_threshold = index
+    return best_threshold
+
+# thresholding at the Otsu threshold of the image instead of a fixed value, for pixel values between 0 and 255
+# pass the histogram (256 bins, as from computeHistogram) if it has already been computed, otherwise it is counted here
+# returns the thresholded image, as from simpleThresholding, and the threshold that was chosen
+def otsuThresholding(pixel_array, image_width, image_height, packed=False, histogram=None):
+    if histogram is None:
+        histogram = computeHistogram(pixel_array, image_width, image_height)
+    threshold = computeOtsuThreshold(histogram) * 256 // len(histogram)
+    return (simpleThresholding(pixel_array, image_width, image_height, packed, threshold), threshold)
+
+# the detection front end fused into one kernel: contrastStretch, computeStandardDeviationImage5x5, contrastStretch
+# and thresholding of an 8 bit greyscale image, giving the same mask as running the stages one after another
+# (up to the rare standard deviation that float rounding puts on the other side of an integer)
+# greyscale_rows can be any iterable of rows, such as a pixel array or the rows of a png reader
+# only the global minimum and maximum force extra passes, so instead of a full image per stage this keeps
+#   pass 1: the greyscale rows as bytearrays, while finding their minimum and maximum
+#           (rows that already are bytearrays of image_width bytes are used as they are, the rows are never changed)
+#   pass 2: the standard deviation in bands of band_height rows, each stretched with 2 rows above and below it,
+#           kept truncated to int (what the second stretch looks at) in bytearrays, dropping greyscale rows on the
+#           way (which frees them unless the caller still holds them)
+#   pass 3: one translate table from those ints straight to mask bits
+# threshold=None thresholds at the Otsu threshold instead, from a histogram of the same ints
+# returns the mask as a BinaryImage and the threshold that was used
+def computeEdgeMask(greyscale_rows, image_width, image_height, threshold=150, band_height=32):
+    half = 2
+    rows = []
+    for row in greyscale_rows:
+        if not isinstance(row, bytearray) or len(row) != image_width:
+            row = bytearray(row[:image_width])
+        rows.append(row)
+        if len(rows) == image_height:
+            break
+    mini = min(min(row) for row in rows)
+    maxi = max(max(row) for row in rows)
+    (grey_lut, grey_offset) = createRangeStretchTable(mini, maxi)
+
+    edge_rows = []
+    edge_mini = None
+    edge_maxi = None
+    # for Otsu the int standard deviations are counted as their rows are made, the counts are mapped through the
+    # second stretch once its table is known, so the histogram costs no pass of its own
+    counts = collections.Counter() if threshold is None else None
+    for start in range(0, image_height, band_height):
+        end = min(start + band_height, image_height)
+        top = max(start - half, 0)
+        bottom = min(end + half, image_height)
+        band = [applyLookupTable(rows[i], grey_lut, grey_offset) for i in range(top, bottom)]
+        standarddev = computeStandardDeviationImage(band, image_width, bottom - top, 2 * half + 1)
+        for row in standarddev[start - top:end - top]:
+            row_mini = min(row)
+            row_maxi = max(row)
+            if edge_mini is None or row_mini < edge_mini:
+                edge_mini = row_mini
+            if edge_maxi is None or row_maxi > edge_maxi:
+                edge_maxi = row_maxi
+            edge_row = bytearray(map(int, row))
+            if counts is not None:
+                counts.update(edge_row)
+            edge_rows.append(edge_row)
+        # rows above the next band's upper halo are not needed any more
+        for i in range(top, max(end - half, 0)):
+            rows[i] = None
+
+    if edge_maxi == edge_mini:
+        edge_lut = [0] * 256
+    else:
+        edge_lut = createStretchTable(edge_mini, edge_maxi)[0]
+        edge_lut += [0] * (256 - len(edge_lut))
+
+    if threshold is None:
+        histogram = [0] * 256
+        for value, count in counts.items():
+            histogram[int(edge_lut[value])] += count
+        threshold = computeOtsuThreshold(histogram)
+
+    bit_table = bytes(ord('1') if value > threshold else ord('0') for value in edge_lut)
+    mask_rows = [int(row.translate(bit_table)[::-1], 2) if image_width else 0 for row in edge_rows]
+    return (BinaryImage(image_width, image_height, mask_rows), threshold)
+
+# for a list of lists of booleans, returns whether each pixel has a True pixel within radius in both x and y
+# (a (2 * radius + 1) square window, clipped to the image), computed as a separable row pass and column pass
+# each pass counts the True pixels in the window with a prefix sum, so the cost per pixel does not depend on radius
+def computeWindowAny(mask, image_width, image_height, radius):
+
+    column_starts = [max(0, j - radius) for j in range(image_width)]
+    column_ends = [min(image_width, j + radius + 1) for j in range(image_width)]
+    row_starts = [max(0, i - radius) for i in range(image_height)]
+    row_ends = [min(image_height, i + radius + 1) for i in range(image_height)]
+
+    rows = []
+    for row in mask:
+        prefix = [0]
+        prefix.extend(itertools.accumulate(row))
+        rows.append([prefix[end] > prefix[start] for start, end in zip(column_starts, column_ends)])
+
+    columns = []
+    for column in zip(*rows):
+        prefix = [0]
+        prefix.extend(itertools.accumulate(column))
+        columns.append([prefix[end] > prefix[start] for start, end in zip(row_starts, row_ends)])
+
+    return [list(row) for row in zip(*columns)]
+
+# erosion with a size x size square structuring element (size must be odd), applied iterations times
+# the result is identical to calling the 3x3 version iterations times: as then, a pixel becomes 255 when no 0 pixel
+# lies within iterations * (size // 2) of it, and the band of size // 2 pixels around the border is left at 1
+# all iterations are done in a single pass, so e.g. four 3x3 erosions cost the same as one
+# a BinaryImage is eroded with whole-row bit operations and a BinaryImage is returned, its border band is foreground
+def erodeImage(pixel_array, image_width, image_height, size=3, iterations=1):
+    border = size // 2
+    if isinstance(pixel_array, BinaryImage):
+        mask = pixel_array.rowMask()
+        background = BinaryImage(image_width, image_height, [~row & mask for row in pixel_array.rows])
+        background_near = computeBinaryWindowAny(background, iterations * border)
+        band = mask & ~(((1 << max(0, image_width - 2 * border)) - 1) << border)
+        rows = [mask if i < border or i >= image_height - border else (~near & mask) | band
+                for i, near in enumerate(background_near.rows)]
+        return BinaryImage(image_width, image_height, rows)
+
     erosion = createInitializedGreyscalePixelArray(image_width, image_height, 1)
-    for i in range(1,image_height-1):
-        for j in range(1, image_width-1):
-            for ii in range(-1,2):
-                for jj in range(-1,2):
-                    if(pixel_array[i+ii][j+jj]==0):
-                        erosion[i][j]=0
-            if(erosion[i][j]!=0):
-                erosion[i][j]=255
+    zero_near = computeWindowAny([[value == 0 for value in row] for row in pixel_array],
+                                 image_width, image_height, iterations * border)
+    for i in range(border, image_height - border):
+        erosion[i][border:image_width - border] = [0 if near else 255 for near in zero_near[i][border:image_width - border]]
     return erosion
 
-def diluteImage(pixel_array, image_width, image_height):
+# dilation with a size x size square structuring element (size must be odd), applied iterations times
+# the result is identical to calling the 3x3 version iterations times: as then, a pixel becomes 255 when a 255 pixel
+# lies within iterations * (size // 2) of it, and the band of size // 2 pixels around the border is left at 0
+# all iterations are done in a single pass, so e.g. four 3x3 dilations cost the same as one
+# a BinaryImage is dilated with whole-row bit operations and a BinaryImage is returned, all its set pixels are foreground
+def diluteImage(pixel_array, image_width, image_height, size=3, iterations=1):
+    border = size // 2
+    if isinstance(pixel_array, BinaryImage):
+        foreground_near = computeBinaryWindowAny(pixel_array, iterations * border)
+        interior = ((1 << max(0, image_width - 2 * border)) - 1) << border
+        rows = [0 if i < border or i >= image_height - border else near & interior
+                for i, near in enumerate(foreground_near.rows)]
+        return BinaryImage(image_width, image_height, rows)
+
     dilution = createInitializedGreyscalePixelArray(image_width, image_height)
-    for i in range(1,image_height-1):
-        for j in range(1, image_width-1):
-            for ii in range(-1,2):
-                for jj in range(-1,2):
-                    if(pixel_array[i+ii][j+jj]==255):
-                        dilution[i][j]=255
-            if(dilution[i][j]==0):
-                dilution[i][j]=0
+    foreground_near = computeWindowAny([[value == 255 for value in row] for row in pixel_array],
+                                       image_width, image_height, iterations * border)
+    for i in range(border, image_height - border):
+        dilution[i][border:image_width - border] = [255 if near else 0 for near in foreground_near[i][border:image_width - border]]
     return dilution
-            
-class Queue:
-   def __init__(self):
-       self.items=[]
-  
-   def isEmpty(self):
-       return self.items==[]
-      
-   def enqueue(self, item):
-       self.items.insert(0,item)
-      
-   def dequeue(self):
-       return self.items.pop()
-      
-   def size(self):
-       return len(self.items)
-      
-q=Queue()
 
-x=[-1,0,1,0]
-y=[0,1,0,-1]
+# streaming pipeline: each stage below is a generator that consumes rows and yields rows, looking back at no more
+# rows than its window needs, so stages can be chained straight onto the rows of a png reader and the first
+# rows are processed while the rest of the png is still being inflated
+# stages that would need a global statistic (the min and max of the contrast stretches) take it as an argument,
+# as it is not known until the last row has been seen
+
+# opens a png for streaming: returns width, height and a generator of greyscale rows (bytearrays), decoded on demand
+def readGreyscaleImageRows(input_filename):
+
+    image_reader = imageIO.png.Reader(filename=input_filename)
+    (image_width, image_height, greyscale_image_rows, greyscale_image_info) = image_reader.asLuma8()
+    return (image_width, image_height, greyscale_image_rows)
+
+# the contrastStretch of each row, for an image whose minimum and maximum are already known
+# every value must lie between mini and maxi, as the lookup table of the stretch only covers that range
+def iterContrastStretchRows(rows, mini, maxi):
+    (lut, offset) = createRangeStretchTable(mini, maxi)
+    for row in rows:
+        yield applyLookupTable(row, lut, offset)
+
+# the rows of computeStandardDeviationImage (same zero padding), from a window of the last window_size rows
+# the output lags window_size // 2 rows behind the input, the last rows come out once the input ends
+def iterStandardDeviationRows(rows, image_width, window_size=5):
+    numpy = imageIO.png.import_numpy()
+    if window_size < 1 or window_size % 2 == 0:
+        raise ValueError("window_size must be a positive odd number, got {}".format(window_size))
+    half = window_size // 2
+    window_area = window_size * window_size
+    zeros = [0] * image_width
+    window = collections.deque([(zeros, zeros)] * window_size, maxlen=window_size)
+
+    def windowRowNumpy():
+        # the same sums in the same order as below, so the values are identical
+        column_sums = numpy.zeros(image_width + 2 * half)
+        column_squares = numpy.zeros(image_width + 2 * half)
+        for values, squares in window:
+            column_sums[half:half + image_width] += values
+            column_squares[half:half + image_width] += squares
+        prefix_sums = numpy.concatenate(([0.0], numpy.cumsum(column_sums)))
+        prefix_squares = numpy.concatenate(([0.0], numpy.cumsum(column_squares)))
+        window_sum = prefix_sums[window_size:] - prefix_sums[:-window_size]
+        window_square = prefix_squares[window_size:] - prefix_squares[:-window_size]
+        variance = (window_area * window_square - window_sum * window_sum) / (window_area * window_area)
+        return numpy.sqrt(numpy.maximum(variance, 0.0)).tolist()
+
+    def windowRow():
+        if numpy is not None:
+            return windowRowNumpy()
+        column_sums = [0] * half + list(map(sum, zip(*[values for values, squares in window]))) + [0] * half
+        column_squares = [0] * half + list(map(sum, zip(*[squares for values, squares in window]))) + [0] * half
+        prefix_sums = [0]
+        prefix_sums.extend(itertools.accumulate(column_sums))
+        prefix_squares = [0]
+        prefix_squares.extend(itertools.accumulate(column_squares))
+        standarddev_row = []
+        for j in range(image_width):
+            window_sum = prefix_sums[j + window_size] - prefix_sums[j]
+            window_square = prefix_squares[j + window_size] - prefix_squares[j]
+            variance = (window_area * window_square - window_sum * window_sum) / (window_area * window_area)
+            standarddev_row.append(math.sqrt(variance) if variance > 0 else 0.0)
+        return standarddev_row
+
+    # row i comes out once rows up to i + half are in the window, below the image the window fills up with zeros
+    appended = 0
+    i = 0
+    for row in rows:
+        values = list(row[:image_width])
+        window.append((values, [value * value for value in values]))
+        appended += 1
+        if appended > i + half:
+            yield windowRow()
+            i += 1
+    row_count = appended
+    while i < row_count:
+        while appended <= i + half:
+            window.append((zeros, zeros))
+            appended += 1
+        yield windowRow()
+        i += 1
+
+# BinaryImage rows (ints, bit j is pixel j) of the pixels that are > threshold
+# with stretch_bounds = (mini, maxi) the values are first put through the contrastStretch for that min and max,
+# truncating them to int as it does, so this can threshold a stretched image without the stretch stage
+# (as in iterContrastStretchRows, every value must lie between mini and maxi)
+def iterThresholdRows(rows, image_width, threshold=150, stretch_bounds=None):
+    lut = None
+    if stretch_bounds is not None:
+        (mini, maxi) = stretch_bounds
+        (lut, offset) = createRangeStretchTable(mini, maxi)
+    for row in rows:
+        if lut is not None:
+            row = applyLookupTable(row[:image_width], lut, offset)
+        bits = ''.join('1' if value > threshold else '0' for value in row[image_width - 1::-1])
+        yield int(bits, 2) if bits else 0
+
+# the rows of diluteImage (or erodeImage, with erode=True) for a BinaryImage, from BinaryImage rows
+# image_height is needed up front to know where the bottom border band starts
+# the output lags iterations * (size // 2) rows behind the input
+def iterMorphologyRows(rows, image_width, image_height, size=3, iterations=1, erode=False):
+    border = size // 2
+    radius = iterations * border
+    mask = (1 << image_width) - 1
+    interior = ((1 << max(0, image_width - 2 * border)) - 1) << border
+    band = mask & ~interior
+    # erosion grows the background instead of the foreground
+    window = collections.deque([0] * radius, maxlen=2 * radius + 1)
+
+    def outputRow(i):
+        if i < border or i >= image_height - border:
+            return mask if erode else 0
+        near = 0
+        for row in window:
+            near |= row
+        return ((~near & mask) | band) if erode else near & interior
+
+    # as in iterStandardDeviationRows, row i comes out once rows up to i + radius are in the window
+    appended = 0
+    i = 0
+    for row in rows:
+        window.append(computeRowWindowAny(~row & mask if erode else row, radius, mask))
+        appended += 1
+        if appended > i + radius:
+            yield outputRow(i)
+            i += 1
+    row_count = appended
+    while i < row_count:
+        while appended <= i + radius:
+            window.append(0)
+            appended += 1
+        yield outputRow(i)
+        i += 1
+
+# the front end of main as one streaming chain, from a png file to the closed plate mask
+# grey_bounds and edge_bounds are the (min, max) used by the two contrast stretches, the defaults are the full
+# ranges of an 8 bit image and of its standard deviation, pass the real ones if they are known (e.g. from a smaller
+# version of the image) to get the same mask as main
+# only the packed rows of the result are ever kept
+def streamClosedEdgeMask(input_filename, grey_bounds=(0, 255), edge_bounds=(0, 127.5), threshold=150,
+                         closing_iterations=4):
+    (image_width, image_height, rows) = readGreyscaleImageRows(input_filename)
+    rows = iterContrastStretchRows(rows, *grey_bounds)
+    rows = iterStandardDeviationRows(rows, image_width, 5)
+    rows = iterThresholdRows(rows, image_width, threshold, edge_bounds)
+    rows = iterMorphologyRows(rows, image_width, image_height, 3, closing_iterations)
+    rows = iterMorphologyRows(rows, image_width, image_height, 3, closing_iterations, erode=True)
+    return BinaryImage(image_width, image_height, list(rows))
+
+# offsets of the 4 neighbours of a pixel, as (row, column) pairs
+NEIGHBOUR_OFFSETS = ((-1, 0), (0, 1), (1, 0), (0, -1))
 
 
+# breadth first traversal of the component containing (i, j), labeling it with count
+# the queue is local to the call, so several images can be labeled at once from different threads
 def bfs_traversal(pixel_array, visited, i, j, width, height, ccimg, count):
    number=0
-  
+   q=collections.deque()
 
-   q.enqueue((i,j))
+   q.append((i,j))
    visited[i][j]=True
   
   
-   while(not q.isEmpty()):
-       a,b=q.dequeue()
+   while q:
+       a,b=q.popleft()
        ccimg[a][b]=count
        number+=1
       
-       for z in range(4):
-           newI=a+x[z]
-           newJ=b+y[z]
+       for di, dj in NEIGHBOUR_OFFSETS:
+           newI=a+di
+           newJ=b+dj
            if newI>=0 and newI<height and newJ>=0 and newJ<width and not visited[newI][newJ] and pixel_array[newI][newJ]!=0:
                visited[newI][newJ]=True
-               q.enqueue((newI,newJ))
+               q.append((newI,newJ))
               
    
    return number
 
 
 def computeConnectedComponentLabeling(pixel_array, width, height):
-   
+   if isinstance(pixel_array, BinaryImage):
+       pixel_array = pixel_array.toPixelArray()
    visited=[]
    ccimg=[]
   
@@ -666,60 +739,370 @@ def computeConnectedComponentLabeling(pixel_array, width, height):
    return (ccimg, ccsizedict, xdict, ydict)
                   
 
-def findPlate2(xdic, ydic, comp_array, comp_dict, image_width, image_height):
-    marklist = sorted(comp_dict.items(), key=lambda x:x[1])
-    length = len(marklist)
-    interest = []
-    one = marklist[length-1]
-    interest.append(one)
-    two = marklist[length-2]
-    interest.append(two)
-    three = marklist[length-3]
-    interest.append(three)
-    four = marklist[length-4]
-    interest.append(four)
-    for tup in interest:
-        comp = tup[0]
-        print(comp)
-        loc = {}
-        for k in range(image_height):
-            for l in range(image_width):
-                if(comp_array[k][l] == comp):
-                    loc[k]= l
-        print(loc)
-        # loclist = sorted(comp_dict.items(), key=lambda x:x[1])
-        # lenloc = len(loclist)
-        h = []
-        for key in loc.keys():
-            h.append(key)
-        h.sort()
-        # lenh = len(h)
-        # loctup = loclist[lenloc-1]
-        x = 0
-        x1 = xdic.get(comp)
-        y = 0
-        y1 = ydic.get(comp)
-        for hi in h:
-            if(loc.get(hi)>x):
-                x = loc.get(hi)
-            if(loc.get(hi)<x1):
-                x1 = loc.get(hi)
-            if(hi > y):
-                y = hi
-            if(hi<y1):
-                y1 = hi
-        print(x,x1,y,y1)
-        width = x-x1
-        height = y-y1
-        area = width*height
-        print(area)
+# statistics of one connected component: its pixel count, bounding box (inclusive), centroid,
+# and its first pixel in raster order (the pixel computeConnectedComponentLabeling reports in xdict and ydict)
+ComponentStatistics = collections.namedtuple(
+    'ComponentStatistics', 'size min_x min_y max_x max_y centroid_x centroid_y first_x first_y')
+
+# returns the (start, end) column ranges of the runs of set bits in a BinaryImage row, left to right
+def findRowRuns(row, image_width):
+    bits = format(row, '0{}b'.format(image_width))[::-1]
+    return [match.span() for match in re.finditer('1+', bits)]
+
+# two pass connected component labeling of the non zero pixels, connectivity is 4 or 8
+# the first pass scans the runs of foreground pixels row by row, giving each run a provisional label and recording
+# in a union-find table (with path compression) which labels touch; the second pass resolves every run to its final label
+# labels are numbered in raster order of the components' first pixels, like computeConnectedComponentLabeling
+# returns the label image and a dict from label to ComponentStatistics, gathered from the runs as they are scanned
+def computeConnectedComponentStatistics(pixel_array, image_width, image_height, connectivity=4):
+    if connectivity not in (4, 8):
+        raise ValueError("connectivity must be 4 or 8, got {}".format(connectivity))
+    if not isinstance(pixel_array, BinaryImage):
+        pixel_array = BinaryImage.fromPixelArray(pixel_array, image_width, image_height)
+    # with 8 connectivity, runs that only touch diagonally are connected too
+    reach = 1 if connectivity == 8 else 0
+
+    # parent[label] is the union-find parent of a provisional label, 0 is unused
+    parent = [0]
+
+    def find(label):
+        root = label
+        while parent[root] != root:
+            root = parent[root]
+        while parent[label] != root:
+            parent[label], label = root, parent[label]
+        return root
+
+    # first pass: runs as (y, start, end, provisional label)
+    runs = []
+    previous_runs = []
+    for y in range(image_height):
+        current_runs = []
+        k = 0
+        for start, end in findRowRuns(pixel_array.rows[y], image_width):
+            # skip runs of the row above that end before this one (or its diagonal neighbour) starts
+            while k < len(previous_runs) and previous_runs[k][1] + reach <= start:
+                k += 1
+            label = 0
+            m = k
+            while m < len(previous_runs) and previous_runs[m][0] < end + reach:
+                root = find(previous_runs[m][2])
+                if label == 0:
+                    label = root
+                elif root != label:
+                    # the smaller label is kept as the root, so roots are the components' first labels
+                    parent[max(root, label)] = min(root, label)
+                    label = min(root, label)
+                m += 1
+            if label == 0:
+                label = len(parent)
+                parent.append(label)
+            current_runs.append((start, end, label))
+            runs.append((y, start, end, label))
+        previous_runs = current_runs
+
+    # second pass: number the roots in order, then label every run and gather its component's statistics
+    final_labels = [0] * len(parent)
+    count = 0
+    for label in range(1, len(parent)):
+        root = find(label)
+        if root == label:
+            count += 1
+            final_labels[label] = count
+        else:
+            final_labels[label] = final_labels[root]
+
+    ccimg = createInitializedGreyscalePixelArray(image_width, image_height)
+    sizes = [0] * (count + 1)
+    sums_x = [0] * (count + 1)
+    sums_y = [0] * (count + 1)
+    boxes = [None] * (count + 1)
+    firsts = [None] * (count + 1)
+    for y, start, end, label in runs:
+        label = final_labels[label]
+        length = end - start
+        ccimg[y][start:end] = [label] * length
+        sizes[label] += length
+        sums_x[label] += (start + end - 1) * length // 2
+        sums_y[label] += y * length
+        if boxes[label] is None:
+            firsts[label] = (start, y)
+            boxes[label] = [start, y, end - 1, y]
+        else:
+            box = boxes[label]
+            box[0] = min(box[0], start)
+            box[2] = max(box[2], end - 1)
+            box[3] = y
+
+    components = {}
+    for label in range(1, count + 1):
+        min_x, min_y, max_x, max_y = boxes[label]
+        components[label] = ComponentStatistics(sizes[label], min_x, min_y, max_x, max_y,
+                                                sums_x[label] / sizes[label], sums_y[label] / sizes[label],
+                                                firsts[label][0], firsts[label][1])
+    return (ccimg, components)
+
+
+# labels many binary images in parallel on a thread pool, masks is a sequence of (pixel_array, width, height)
+# returns one (ccimg, components) result per mask, in order, as from computeConnectedComponentStatistics
+# labeling keeps no state outside each call, so the threads cannot see each other's images
+def computeConnectedComponentStatisticsBatch(masks, max_workers=None, connectivity=4):
+    import concurrent.futures
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(computeConnectedComponentStatistics, pixel_array, width, height, connectivity)
+                   for (pixel_array, width, height) in masks]
+        return [future.result() for future in futures]
+
+
+# picks the licence plate out of the labeled components, given the dict from label to ComponentStatistics
+# only the top_k largest components are looked at, largest first, and the first one whose rounded aspect ratio
+# is between 1.5 and its height in pixels is taken; the bounding boxes come straight from the statistics,
+# so no pass over the label image is needed
+# returns (max_x, min_x, max_y, min_y) of the plate, or None when no component fits
+def findPlate2(components, top_k=4):
+    largest = sorted(components.items(), key=lambda item: (item[1].size, item[0]), reverse=True)
+    for label, component in largest[:top_k]:
+        width = component.max_x - component.min_x
+        height = component.max_y - component.min_y
+        if height == 0:
+            continue
         ratio = round(width/height)
         if((1.5<ratio<height)):
-            return(x,x1,y,y1)
-        
+            return (component.max_x, component.min_x, component.max_y, component.min_y)
+    return None
+
+
+# plate candidate scoring: every component gets a score between 0 and 1 for each feature below,
+# and its overall score is the product of the feature scores, each raised to the power of its weight
+# a weight of 0 switches a feature off, a larger weight makes a feature count for more
+PLATE_SCORE_WEIGHTS = {'aspect_ratio': 1.0, 'fill_density': 1.0, 'area': 2.0, 'edge_density': 1.0}
 
+# width to height of the bounding box, anything from a square-ish US plate to a long EU plate scores 1
+PLATE_ASPECT_RATIO_RANGE = (1.8, 5.5)
+# bounding box area as a fraction of the image area
+PLATE_AREA_FRACTION_RANGE = (0.005, 0.3)
 
-            
+# a ranked plate candidate, min/max x/y are its inclusive bounding box and features maps feature name to its score
+PlateCandidate = collections.namedtuple('PlateCandidate', 'label score min_x min_y max_x max_y features')
+
+# 1 for values inside [lower, upper], falling off proportionally outside of it
+def scoreInRange(value, lower, upper):
+    if value < lower:
+        return value / lower
+    if value > upper:
+        return upper / value
+    return 1.0
+
+# the number of set pixels of a BinaryImage inside an inclusive box
+def countBoxPixels(binary_image, min_x, min_y, max_x, max_y):
+    box_mask = (1 << (max_x - min_x + 1)) - 1
+    return sum(bin((binary_image.rows[y] >> min_x) & box_mask).count('1') for y in range(min_y, max_y + 1))
+
+# scores every feature of every component once, from the labeling statistics
+# edge_mask is the thresholded edge image (before closing); without it the edge density feature is left out
+# returns the labels and a dict from feature name to the list of that feature's scores, in label order
+def computePlateCandidateFeatures(components, image_width, image_height, edge_mask=None):
+    if edge_mask is not None and not isinstance(edge_mask, BinaryImage):
+        edge_mask = BinaryImage.fromPixelArray(edge_mask, image_width, image_height)
+
+    labels = sorted(components)
+    features = {'aspect_ratio': [], 'fill_density': [], 'area': []}
+    if edge_mask is not None:
+        features['edge_density'] = []
+    for label in labels:
+        component = components[label]
+        box_width = component.max_x - component.min_x + 1
+        box_height = component.max_y - component.min_y + 1
+        box_area = box_width * box_height
+        features['aspect_ratio'].append(scoreInRange(box_width / box_height, *PLATE_ASPECT_RATIO_RANGE))
+        features['fill_density'].append(component.size / box_area)
+        features['area'].append(scoreInRange(box_area / (image_width * image_height), *PLATE_AREA_FRACTION_RANGE))
+        if edge_mask is not None:
+            edge_pixels = countBoxPixels(edge_mask, component.min_x, component.min_y, component.max_x, component.max_y)
+            features['edge_density'].append(edge_pixels / box_area)
+    return (labels, features)
+
+# ranks all components as licence plate candidates, best first
+# weights overrides PLATE_SCORE_WEIGHTS, features missing from it keep their default weight
+# with numpy the scores of all candidates are computed at once as exp(log(features) . weights)
+def rankPlateCandidates(components, image_width, image_height, edge_mask=None, weights=None):
+    numpy = imageIO.png.import_numpy()
+    weights = dict(PLATE_SCORE_WEIGHTS, **(weights or {}))
+    (labels, features) = computePlateCandidateFeatures(components, image_width, image_height, edge_mask)
+    names = list(features)
+    # features that are switched off are left out of the product, so a zero score in one of them can't count
+    scored_names = [name for name in names if weights[name] != 0]
+
+    if numpy is not None and labels and scored_names:
+        feature_matrix = numpy.array([features[name] for name in scored_names], dtype=numpy.float64).T
+        weight_vector = numpy.array([weights[name] for name in scored_names], dtype=numpy.float64)
+        with numpy.errstate(divide='ignore'):
+            scores = numpy.exp(numpy.log(feature_matrix) @ weight_vector).tolist()
+    else:
+        scores = [math.prod(features[name][index] ** weights[name] for name in scored_names)
+                  for index in range(len(labels))]
+
+    candidates = []
+    for index, label in enumerate(labels):
+        component = components[label]
+        candidates.append(PlateCandidate(label, scores[index], component.min_x, component.min_y,
+                                         component.max_x, component.max_y,
+                                         {name: features[name][index] for name in names}))
+    candidates.sort(key=lambda candidate: (-candidate.score, candidate.label))
+    return candidates
+
+
+# the rows of an 8 bit RGB (planes=3) or RGBA (planes=4) image with the outline of a rectangle drawn in,
+# bbox is (min_x, min_y, max_x, max_y), inclusive and clipped to the image, the outline is line_width pixels thick
+# on the inside of the box, rows are drawn into one at a time, as they come
+def iterRowsWithRectangle(rows, image_width, planes, bbox, colour=(0, 255, 0), line_width=2):
+    (min_x, min_y, max_x, max_y) = bbox
+    min_x = max(min_x, 0)
+    max_x = min(max_x, image_width - 1)
+    pixel = bytes(colour) + (b'\xff' if planes == 4 else b'')
+
+    def paint(row, start, end):
+        if start <= end:
+            row[start * planes:(end + 1) * planes] = pixel * (end - start + 1)
+
+    for y, row in enumerate(rows):
+        if min_y <= y <= max_y and min_x <= max_x:
+            row = bytearray(row)
+            if y < min_y + line_width or y > max_y - line_width:
+                paint(row, min_x, max_x)
+            else:
+                paint(row, min_x, min(min_x + line_width - 1, max_x))
+                paint(row, max(max_x - line_width + 1, min_x), max_x)
+        yield row
+
+# writes input_filename with the plate bounding box drawn in as a png of the same size, without matplotlib
+# the colour image is decoded, drawn into and encoded again one row at a time
+# bbox is (min_x, min_y, max_x, max_y) as in PlateDetection, or None to write the image unchanged
+def renderDetectionImage(input_filename, bbox, output_filename, colour=(0, 255, 0), line_width=2):
+    image_reader = imageIO.png.Reader(filename=input_filename)
+    image_reader.preamble()
+    if image_reader.alpha or image_reader.trns:
+        (image_width, image_height, rows, info) = image_reader.asRGBA8()
+    else:
+        (image_width, image_height, rows, info) = image_reader.asRGB8()
+    planes = info['planes']
+    if bbox is not None:
+        rows = iterRowsWithRectangle(rows, image_width, planes, bbox, colour, line_width)
+
+    image_writer = imageIO.png.Writer(image_width, image_height, greyscale=False, alpha=planes == 4, bitdepth=8)
+    with open(output_filename, 'wb') as output_file:
+        image_writer.write(output_file, rows)
+
+# the result of detectLicensePlate: the greyscale rows (bytearrays), the threshold the edge image was cut at (150, or
+# the Otsu threshold when that was asked for), the thresholded edge mask and the closed mask (BinaryImages), the ranked
+# plate candidates, the plate bounding box (min_x, min_y, max_x, max_y) or None if nothing was found, and the seconds
+# spent in each stage
+PlateDetection = collections.namedtuple(
+    'PlateDetection', 'image_width image_height greyscale threshold thresholded closed candidates bbox timings')
+
+# the whole detection of main for one png file, without any plotting
+def detectLicensePlate(input_filename, use_otsu_threshold=False):
+    timings = {}
+    start = time.perf_counter()
+
+    (image_width, image_height, rows) = readGreyscaleImageRows(input_filename)
+    # asLuma8 already gives a new bytearray for every row, so the rows are kept as they are
+    greyscale = list(rows)
+    timings['read'] = time.perf_counter() - start
+    stage_start = time.perf_counter()
+
+    (thresholded, threshold) = computeEdgeMask(greyscale, image_width, image_height,
+                                               None if use_otsu_threshold else 150)
+    timings['edge_mask'] = time.perf_counter() - stage_start
+    stage_start = time.perf_counter()
+
+    # morphological closing: four 3x3 dilations followed by four 3x3 erosions, each done as a single pass
+    dilated = diluteImage(thresholded, image_width, image_height, 3, 4)
+    closed = erodeImage(dilated, image_width, image_height, 3, 4)
+    timings['closing'] = time.perf_counter() - stage_start
+    stage_start = time.perf_counter()
+
+    (ccimg, components) = computeConnectedComponentStatistics(closed, image_width, image_height)
+    timings['labeling'] = time.perf_counter() - stage_start
+    stage_start = time.perf_counter()
+
+    candidates = rankPlateCandidates(components, image_width, image_height, edge_mask=thresholded)
+    bbox = None
+    if candidates:
+        bbox = (candidates[0].min_x, candidates[0].min_y, candidates[0].max_x, candidates[0].max_y)
+    timings['ranking'] = time.perf_counter() - stage_start
+    timings['total'] = time.perf_counter() - start
+
+    return PlateDetection(image_width, image_height, greyscale, threshold, thresholded, closed, candidates, bbox,
+                          timings)
+
+# detection of one file in a batch, as a dict that can be written as a json line
+# a file that fails gets an error entry instead, so one bad frame doesn't stop the batch
+def detectLicensePlateRecord(input_filename, use_otsu_threshold=False):
+    try:
+        detection = detectLicensePlate(input_filename, use_otsu_threshold)
+    except Exception as error:
+        return {'input': input_filename, 'error': str(error), 'error_type': type(error).__name__}
+    record = {'input': input_filename, 'width': detection.image_width, 'height': detection.image_height,
+              'threshold': detection.threshold,
+              'bbox': list(detection.bbox) if detection.bbox is not None else None,
+              'score': detection.candidates[0].score if detection.candidates else None,
+              'timings': {stage: round(seconds, 6) for stage, seconds in detection.timings.items()}}
+    return record
+
+# the png files a batch runs on, from a directory, glob patterns and/or a list of files (one per line) on stdin
+def collectBatchInputs(input_dirs, patterns, read_stdin):
+    import glob
+
+    inputs = []
+    for input_dir in input_dirs:
+        inputs.extend(sorted(str(path) for path in Path(input_dir).iterdir()
+                             if path.is_file() and path.suffix.lower() == '.png'))
+    for pattern in patterns:
+        inputs.extend(sorted(glob.glob(pattern, recursive=True)))
+    if read_stdin:
+        inputs.extend(line.strip() for line in sys.stdin if line.strip())
+    return inputs
+
+# batch mode: detects the plates of many images on a process pool and writes one json line per image,
+# in input order, no figures are made
+# usage: python CS373LicensePlateDetection.py --input-dir DIR | --glob PATTERN | --stdin
+#            [--workers N] [--chunksize N] [--output FILE] [--otsu]
+# (the modules only batch mode needs are imported here, so a single image run doesn't pay for loading them)
+def batchMain(command_line_arguments):
+    import argparse
+    import concurrent.futures
+    import json
+
+    parser = argparse.ArgumentParser(description="detect license plates in many png images")
+    parser.add_argument('--input-dir', action='append', default=[], help="process every png file in this directory")
+    parser.add_argument('--glob', action='append', default=[], help="process every file matching this pattern")
+    parser.add_argument('--stdin', action='store_true', help="read file names from stdin, one per line")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes (default: cpu count)")
+    parser.add_argument('--chunksize', type=int, default=8, help="number of images sent to a worker at a time")
+    parser.add_argument('--output', default='-', help="json lines output file (default: stdout)")
+    parser.add_argument('--otsu', action='store_true', help="use the Otsu threshold instead of the fixed one")
+    arguments = parser.parse_args(command_line_arguments)
+
+    inputs = collectBatchInputs(arguments.input_dir, arguments.glob, arguments.stdin)
+    if not inputs:
+        parser.error("no input images, give --input-dir, --glob or --stdin")
+
+    output = sys.stdout if arguments.output == '-' else open(arguments.output, 'w')
+    failures = 0
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=arguments.workers) as executor:
+            records = executor.map(detectLicensePlateRecord, inputs, itertools.repeat(arguments.otsu),
+                                   chunksize=max(1, arguments.chunksize))
+            for record in records:
+                failures += 'error' in record
+                output.write(json.dumps(record) + '\n')
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 1 if failures else 0
 
 # This is our code skeleton that performs the license plate detection.
 # Feel free to try it on your own images of cars, but keep in mind that with our algorithm developed in this lecture,
@@ -727,8 +1110,12 @@ def findPlate2(xdic, ydic, comp_array, comp_dict, image_width, image_height):
 def main():
 
     command_line_arguments = sys.argv[1:]
+    if command_line_arguments and command_line_arguments[0].startswith('--'):
+        return batchMain(command_line_arguments)
 
     SHOW_DEBUG_FIGURES = True
+    # threshold the edge image at its Otsu threshold instead of the fixed value 150
+    USE_OTSU_THRESHOLD = False
 
     # this is the default input image filename
     input_filename = "numberplate5.png"
@@ -747,76 +1134,53 @@ def main():
         output_filename = Path(command_line_arguments[1])
 
 
-    # we read in the png file, and receive three pixel arrays for red, green and blue components, respectively
-    # each pixel array contains 8 bit integer values between 0 and 255 encoding the color values
-    (image_width, image_height, px_array_r, px_array_g, px_array_b) = readRGBImageToSeparatePixelArrays(input_filename)
+    # we read in the png file already converted to greyscale, as the separate colour channels are never used
+    # the pixel rows contain 8 bit integer values between 0 and 255
+    # contrast stretch, 5x5 standard deviation, contrast stretch and threshold are fused so the intermediate
+    # images are never built, the binary stages work on bit packed rows
+    detection = detectLicensePlate(input_filename, USE_OTSU_THRESHOLD)
+    (image_width, image_height) = (detection.image_width, detection.image_height)
+    print("read image width={}, height={}".format(image_width, image_height))
+    if USE_OTSU_THRESHOLD:
+        print("otsu threshold {}".format(detection.threshold))
+    greyscale = detection.greyscale
+    thresholded = detection.thresholded
+    erode1 = detection.closed
+
+    if detection.bbox is not None:
+        (bbox_min_x, bbox_min_y, bbox_max_x, bbox_max_y) = detection.bbox
+    else:
+        # nothing was found at all, so the box covers the whole image
+        (bbox_min_x, bbox_min_y, bbox_max_x, bbox_max_y) = (0, 0, image_width - 1, image_height - 1)
+    px_array = greyscale
 
-    # setup the plots for intermediate results in a figure
-    fig1, axs1 = pyplot.subplots(2, 2)
+    # write the input image with the bounding box drawn in into output_filename, at its own resolution
+    renderDetectionImage(input_filename, (bbox_min_x, bbox_min_y, bbox_max_x, bbox_max_y), output_filename)
 
+    if SHOW_DEBUG_FIGURES:
+        # matplotlib is only needed for the debug figures, so it is not loaded otherwise
+        from matplotlib import pyplot
+        from matplotlib.patches import Rectangle
 
-    # STUDENT IMPLEMENTATION here
-    greyscale = computeRGBToGreyscale(px_array_r, px_array_g, px_array_b, image_width, image_height)
-    contrast = contrastStretch(greyscale, image_width, image_height)
-    edge = computeStandardDeviationImage5x5(contrast, image_width, image_height)
-    edgecontrast = contrastStretch(edge, image_width, image_height)
-    thresholded = simpleThresholding(edgecontrast, image_width, image_height)
-    dilute1 = diluteImage(thresholded, image_width, image_height)
-    for i in range(3):
-        dilute1 = diluteImage(dilute1, image_width, image_height)
-    erode1 = erodeImage(dilute1, image_width, image_height)
-    for i in range(3):
-        erode1 = erodeImage(erode1, image_width, image_height)
+        # setup the plots for intermediate results in a figure
+        fig1, axs1 = pyplot.subplots(2, 2)
 
-    
-    (ccimg,ccsizes, xdic, ydic) = computeConnectedComponentLabeling(erode1,image_width,image_height)
-    print(ccsizes)
-    # print(xdic)
-    # print(ydic)
-    (x1,x2,y1,y2) = findPlate2(xdic, ydic, ccimg, ccsizes, image_width, image_height)
-    width = x2-x1
-    height = y2-y1    
-    #print(greyscale)
-    px_array = greyscale 
-    #fig, ax = pyplot.subplots(figsize =(10, 7))
-    #ax.hist(px_array)
-    #pyplot.show()
-
-    # compute a dummy bounding box centered in the middle of the input image, and with as size of half of width and height
-    center_x = width / 2.0
-    center_y = height / 2.0
-    bbox_min_x = x2
-    bbox_max_x = x1
-    bbox_min_y = y2
-    bbox_max_y = y1
-
-
-
-
-
-    # Draw a bounding box as a rectangle into the input image
-    axs1[0, 0].set_title('Grayscale contrast stretching')
-    axs1[0, 0].imshow(greyscale, cmap="gray")
-    axs1[0, 1].set_title('High contrast regions')
-    axs1[0, 1].imshow(thresholded, cmap="gray")
-    axs1[1, 0].set_title('Morphological Closing')
-    axs1[1, 0].imshow(erode1, cmap='gray')
-    axs1[1, 1].set_title('Final image of detection')
-    axs1[1, 1].imshow(px_array, cmap='gray')
-    rect = Rectangle((bbox_min_x, bbox_min_y), bbox_max_x - bbox_min_x, bbox_max_y - bbox_min_y, linewidth=1,
-                     edgecolor='g', facecolor='none')
-    axs1[1, 1].add_patch(rect)
-
-
-
-    # write the output image into output_filename, using the matplotlib savefig method
-    extent = axs1[1, 1].get_window_extent().transformed(fig1.dpi_scale_trans.inverted())
-    pyplot.savefig(output_filename, bbox_inches=extent, dpi=600)
+        # Draw a bounding box as a rectangle into the input image
+        axs1[0, 0].set_title('Grayscale contrast stretching')
+        axs1[0, 0].imshow(greyscale, cmap="gray")
+        axs1[0, 1].set_title('High contrast regions')
+        axs1[0, 1].imshow(thresholded.toPixelArray(), cmap="gray")
+        axs1[1, 0].set_title('Morphological Closing')
+        axs1[1, 0].imshow(erode1.toPixelArray(), cmap='gray')
+        axs1[1, 1].set_title('Final image of detection')
+        axs1[1, 1].imshow(px_array, cmap='gray')
+        rect = Rectangle((bbox_min_x, bbox_min_y), bbox_max_x - bbox_min_x, bbox_max_y - bbox_min_y, linewidth=1,
+                         edgecolor='g', facecolor='none')
+        axs1[1, 1].add_patch(rect)
 
-    if SHOW_DEBUG_FIGURES:
         # plot the current figure
         pyplot.show()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file